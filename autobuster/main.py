@@ -3,15 +3,24 @@
 import glob
 import hashlib
 import inotify.adapters
+import json
 import os
 import shutil
-import subprocess
+import sys
 import tempfile
+import threading
 import time
 
+sys.path.insert(0, '/var/buster/buster')
+from exporter import Exporter
+from journal import JOURNAL_FILENAME
+import incremental
+import output
+
 # This script waits for modifications to the ghost.db file, creates a
 # data_... directory, runs buster in it, and then updates the "current"
-# symlink to point to the data_... directory.
+# symlink to point to the data_... directory. Buster runs in this process,
+# with one Exporter kept for every export.
 
 db_filename = '/var/lib/ghost/content/data/ghost.db'
 
@@ -19,6 +28,31 @@ os.chdir('/var/static_ghost')
 
 GC_TIME_SECONDS = int(os.environ["GC_TIME_SECONDS"])
 
+# Incremental exports only download what changed according to Ghost's
+# sitemaps. Changes to settings or navigation don't show up there, so a full
+# export is still done at least this often.
+INCREMENTAL_EXPORTS = os.environ.get("INCREMENTAL_EXPORTS", "") not in ("", "0")
+FULL_EXPORT_INTERVAL_SECONDS = int(os.environ.get("FULL_EXPORT_INTERVAL_SECONDS", "3600"))
+
+PRECOMPRESS = os.environ.get("PRECOMPRESS", "") not in ("", "0")
+
+# the stats of every export, one JSON object per line
+STATS_LOG_FILENAME = 'export_stats.jsonl'
+
+# integrity-pinned external scripts, shared by all exports
+SCRIPT_CACHE_DIR = 'script_cache'
+
+# A full export that failed during its crawl is kept, with buster's journal
+# of what it downloaded, and resumed by the next export instead of starting
+# over. This file holds its data_... directory.
+RESUME_FILENAME = 'resume_data_dir.txt'
+
+# A burst of database writes (such as saving a post) is coalesced into one
+# export, started once the database has been quiet for CHANGE_QUIET_SECONDS,
+# or at the latest CHANGE_MAX_DELAY_SECONDS after the first write.
+CHANGE_QUIET_SECONDS = float(os.environ.get("CHANGE_QUIET_SECONDS", "10"))
+CHANGE_MAX_DELAY_SECONDS = float(os.environ.get("CHANGE_MAX_DELAY_SECONDS", "60"))
+
 def file_hash(filename):
     h = hashlib.sha256()
     with open(filename, 'rb', buffering=0) as f:
@@ -27,42 +61,126 @@ def file_hash(filename):
     return h.hexdigest()
 
 
+def db_signature():
+    # Cheap check for modifications before hashing the whole database: the
+    # size and mtime of the database and of its write-ahead log.
+    signature = []
+    for filename in (db_filename, db_filename + '-wal'):
+        try:
+            st = os.stat(filename)
+        except FileNotFoundError:
+            signature.append(None)
+        else:
+            signature.append((st.st_size, st.st_mtime_ns))
+    return tuple(signature)
+
+
 try:
     with open('current_db_hash.txt', 'r') as f:
         current_db_hash = f.read().rstrip()
 except FileNotFoundError:
     current_db_hash = None
 
+last_full_export_time = None
+
+
+def remove_data_dir(data_dir):
+    # with the manifest buster keeps next to it
+    manifest_path = incremental.manifest_path(data_dir)
+    shutil.rmtree(data_dir)
+    if os.path.isfile(manifest_path):
+        os.remove(manifest_path)
+
+
+def take_resumable_data_dir():
+    try:
+        with open(RESUME_FILENAME) as f:
+            data_dir = f.read().rstrip()
+    except FileNotFoundError:
+        return None
+    os.remove(RESUME_FILENAME)
+    if not os.path.isfile(os.path.join(data_dir, JOURNAL_FILENAME)):
+        if os.path.isdir(data_dir):
+            remove_data_dir(data_dir)
+        return None
+    return data_dir
+
+
+def log_stats(data_dir, full_export, stats):
+    stats['data_dir'] = data_dir
+    stats['full_export'] = full_export
+    stats['time'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    with open(STATS_LOG_FILENAME, 'a') as f:
+        f.write(json.dumps(stats, sort_keys=True) + '\n')
+    print('Export took {:.1f}s ({})'.format(stats['wall'], ', '.join(
+        '{} {:.1f}s'.format(name, stage['wall'])
+        for name, stage in stats['stages'].items() if '/' not in name
+    )))
+
+
+exporter = Exporter(
+    os.environ["GHOST_ADDRESS"],
+    os.environ["STATIC_ADDRESS"],
+    user="buster" if "BUSTER_PASSWORD" in os.environ else None,
+    password=os.environ.get("BUSTER_PASSWORD"),
+    precompress=PRECOMPRESS,
+    script_cache=SCRIPT_CACHE_DIR
+)
+
 
 def handle_change():
-    global current_db_hash
-    if current_db_hash == file_hash(db_filename):
+    global current_db_hash, last_full_export_time
+    new_hash = file_hash(db_filename)
+    if current_db_hash == new_hash:
         print('db hash unchanged, ignoring modification')
         return
 
-    print('Modification detected. Waiting before running buster...')
-    time.sleep(10)
-    new_hash = file_hash(db_filename)
+    print('Modification detected. Running buster...')
 
-    timestamp = time.strftime('%Y%m%d%H%M', time.gmtime())
-    data_dir = tempfile.mkdtemp(prefix='data_' + timestamp + '.', dir='.')
+    data_dir = take_resumable_data_dir()
+    if data_dir is not None:
+        print('Resuming the interrupted export in ' + data_dir)
+    else:
+        timestamp = time.strftime('%Y%m%d%H%M', time.gmtime())
+        data_dir = tempfile.mkdtemp(prefix='data_' + timestamp + '.', dir='.')
+    full_export = (
+        not INCREMENTAL_EXPORTS or
+        not os.path.isdir('current') or
+        last_full_export_time is None or
+        time.time() - last_full_export_time >= FULL_EXPORT_INTERVAL_SECONDS or
+        os.path.isfile(os.path.join(data_dir, JOURNAL_FILENAME))
+    )
 
     try:
         os.chmod(data_dir, 0o755)  # owner-read-write, world-readable
-        args = [
-            "python3", "/var/buster/buster/buster.py",
-            "generate", os.environ["GHOST_ADDRESS"], os.environ["STATIC_ADDRESS"],
-            "--path", data_dir
-        ]
-        if "BUSTER_PASSWORD" in os.environ:
-            args.extend(("--user", "buster", "--password", os.environ["BUSTER_PASSWORD"]))
-        subprocess.run(args, check=True)
+        # unchanged files are kept from and shared with the previous export
+        previous_dir = 'current' if os.path.isdir('current') else None
+        export_start_time = time.time()
+        stats = exporter.export(
+            data_dir,
+            previous_dir,
+            # crawl everything, but keep the files Ghost says are unchanged
+            revalidate=full_export and previous_dir is not None,
+            link_dest=previous_dir,
+            # on disk before current points to it
+            sync=True
+        )
+        if full_export:
+            last_full_export_time = export_start_time
+        log_stats(data_dir, full_export, stats.to_dict())
         os.symlink(data_dir, data_dir + '-symlink')
     except:
-        shutil.rmtree(data_dir)
+        if full_export and os.path.isfile(os.path.join(data_dir, JOURNAL_FILENAME)):
+            # the crawl didn't finish; keep what it downloaded
+            with open(RESUME_FILENAME, 'w') as f:
+                f.write(data_dir + '\n')
+            print('Keeping ' + data_dir + ' to resume the export')
+        else:
+            remove_data_dir(data_dir)
         raise
 
     os.replace(data_dir + '-symlink', 'current')
+    output.sync('.')
     print('Updated current')
 
     current_db_hash = new_hash
@@ -72,30 +190,75 @@ def handle_change():
 
     # Delete the old data_ folders.
     for old_data_dir in glob.iglob('data_*'):
-        if os.path.samefile(old_data_dir, data_dir):
+        if not os.path.isdir(old_data_dir) or os.path.samefile(old_data_dir, data_dir):
             continue
         if time.time() - os.path.getmtime(old_data_dir) < GC_TIME_SECONDS:
             continue
-        shutil.rmtree(old_data_dir)
+        remove_data_dir(old_data_dir)
         print('Removed old data directory: ' + old_data_dir)
 
 
+class Scheduler:
+    """Runs handle_change() in a thread once a burst of modifications is
+    over. Modifications during an export make at most one more export, run
+    after it."""
+
+    def __init__(self):
+        self.signature = None
+        self.first_change = None
+        self.last_change = None
+        self.thread = None
+        self.error = None
+
+    def notice(self, now, signature):
+        if signature == self.signature:
+            return
+        self.signature = signature
+        if self.first_change is None:
+            self.first_change = now
+        self.last_change = now
+
+    def poll(self, now):
+        if self.error is not None:
+            raise self.error
+        if self.first_change is None or (self.thread is not None and self.thread.is_alive()):
+            return
+        if (
+                now - self.last_change < CHANGE_QUIET_SECONDS and
+                now - self.first_change < CHANGE_MAX_DELAY_SECONDS
+            ):
+            return
+        self.first_change = self.last_change = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            handle_change()
+        except BaseException as e:
+            self.error = e
+            raise
+
+
 i = inotify.adapters.Inotify()
 i.add_watch(db_filename)
 
 try:
+    scheduler = Scheduler()
     # There might have been a change to the database while this script wasn't
     # running, so check it now. Note that we're doing the check after we set
     # up the inotify listener, so we don't miss any changes that happen during
-    # this function call.
-    handle_change()
+    # the export.
+    scheduler.notice(time.monotonic() - CHANGE_MAX_DELAY_SECONDS, db_signature())
+    scheduler.poll(time.monotonic())
 
+    # event_gen() yields None when there has been no event for a while, so
+    # the scheduler gets polled even when the database is quiet.
     for event in i.event_gen():
-        if event is None:
-            continue
-        (header, type_names, watch_path, filename) = event
-        if 'IN_MODIFY' not in type_names:
-            continue
-        handle_change()
+        if event is not None:
+            (header, type_names, watch_path, filename) = event
+            if 'IN_MODIFY' in type_names:
+                scheduler.notice(time.monotonic(), db_signature())
+        scheduler.poll(time.monotonic())
 finally:
     i.remove_watch(db_filename)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""Time buster generate against a local fake Ghost origin.
+
+The site from fake_ghost.py is served from this process, with its responses
+memoized so the origin's own rendering doesn't count, and buster generate is
+run against it as a subprocess, in the default mode and with --replace-all.
+Its pages carry an integrity-pinned external script, served over HTTPS with
+a throwaway self-signed certificate (made with the openssl command, which is
+skipped if it isn't installed).
+
+For each mode the best of --repeat runs is reported: wall time, pages per
+second, the peak RSS of the buster process and the wall time of every stage
+from its --stats-file.
+
+    $ python3 bench/bench_generate.py --posts 500 --jobs 4 [--json results.json]
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import fake_ghost
+
+BUSTER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'buster', 'buster.py')
+TARGET = 'https://example.com'
+EXTERNAL_SCRIPT = b'(function(){ window.external_script = true; })();\n' * 100
+
+MODES = (
+    ('default', []),
+    ('replace-all', ['--replace-all']),
+)
+
+
+class MemoizedSite:
+    """Renders every path of a site once."""
+
+    def __init__(self, site):
+        self.site = site
+        self.responses = {}
+        self.lock = threading.Lock()
+
+    def render(self, path):
+        with self.lock:
+            if path not in self.responses:
+                self.responses[path] = self.site.render(path)
+            return self.responses[path]
+
+
+def serve_external_script(workdir):
+    """Serve EXTERNAL_SCRIPT over HTTPS. Returns (url, integrity, cafile), or
+    None if openssl isn't available."""
+    if shutil.which('openssl') is None:
+        return None
+    certfile = os.path.join(workdir, 'cert.pem')
+    keyfile = os.path.join(workdir, 'key.pem')
+    subprocess.run([
+        'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+        '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1',
+        '-keyout', keyfile, '-out', certfile
+    ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/javascript')
+            self.send_header('Content-Length', str(len(EXTERNAL_SCRIPT)))
+            self.end_headers()
+            self.wfile.write(EXTERNAL_SCRIPT)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.daemon_threads = True
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, keyfile)
+    httpd.socket = context.wrap_socket(httpd.socket, server_side=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = 'https://localhost:{}/external.min.js'.format(httpd.server_address[1])
+    integrity = 'sha384-' + base64.b64encode(hashlib.sha384(EXTERNAL_SCRIPT).digest()).decode()
+    return url, integrity, certfile
+
+
+def count_pages(static_path):
+    pages = 0
+    for root, dirs, filenames in os.walk(static_path):
+        pages += sum(1 for filename in filenames if filename.endswith(('.html', '.xml')))
+    return pages
+
+
+def run_generate(source, static_path, extra_args, env):
+    """Returns (wall seconds, peak RSS in bytes, stats) of one export."""
+    stats_file = static_path + '.stats.json'
+    args = [sys.executable, BUSTER, 'generate', source, TARGET, '--path', static_path, '--stats-file', stats_file] + extra_args
+    with open(static_path + '.log', 'w') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(args, stdout=log, stderr=subprocess.STDOUT, env=env)
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise Exception('buster failed, see ' + static_path + '.log')
+    with open(stats_file) as f:
+        stats = json.load(f)
+    # ru_maxrss is in kilobytes on Linux
+    return wall, rusage.ru_maxrss * 1024, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark buster generate against a fake Ghost site.')
+    parser.add_argument('--posts', type=int, default=200)
+    parser.add_argument('--tags', type=int, default=10)
+    parser.add_argument('--authors', type=int, default=3)
+    parser.add_argument('--pages', type=int, default=3)
+    parser.add_argument('--paragraphs', type=int, default=8, help='Paragraphs per post')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per mode; the fastest one is reported')
+    parser.add_argument('--mode', choices=[name for name, _ in MODES], action='append', help='Only run these modes')
+    parser.add_argument('--json', help='Also write the results to this file')
+    parser.add_argument('--keep', action='store_true', help="Don't delete the exports and logs")
+    args, buster_args = parser.parse_known_args()
+
+    workdir = tempfile.mkdtemp(prefix='buster-bench-')
+    env = dict(os.environ)
+    external = serve_external_script(workdir)
+    if external is not None:
+        env['SSL_CERT_FILE'] = external[2]
+    else:
+        print('openssl not found, pages have no external script', file=sys.stderr)
+    site = fake_ghost.Site('http://127.0.0.1:0', posts=args.posts, tags=args.tags, authors=args.authors,
+                           pages=args.pages, paragraphs=args.paragraphs,
+                           external_script=external[:2] if external is not None else None)
+    httpd = fake_ghost.serve(MemoizedSite(site))
+    site.url = 'http://127.0.0.1:' + str(httpd.server_address[1])
+
+    print('{} posts, {} tags, {} authors; buster options: {}'.format(
+        args.posts, args.tags, args.authors, ' '.join(buster_args) or '(none)'))
+    results = {}
+    try:
+        for name, mode_args in MODES:
+            if args.mode and name not in args.mode:
+                continue
+            best = None
+            for i in range(args.repeat):
+                static_path = os.path.join(workdir, name + '-' + str(i))
+                wall, rss, stats = run_generate(site.url, static_path, mode_args + buster_args, env)
+                pages = count_pages(static_path)
+                if best is None or wall < best['wall']:
+                    best = {'wall': wall, 'pages': pages, 'pages_per_second': pages / wall, 'peak_rss': rss,
+                            'stages': {stage: values['wall'] for stage, values in stats['stages'].items()}}
+                if not args.keep:
+                    shutil.rmtree(static_path)
+            results[name] = best
+            print('{:12} {:8.2f} s  {:8.1f} pages/s  {:8.1f} MB peak RSS  ({} pages)'.format(
+                name, best['wall'], best['pages_per_second'], best['peak_rss'] / 1e6, best['pages']))
+            for stage, seconds in best['stages'].items():
+                print('    {:24} {:8.3f} s'.format(stage, seconds))
+    finally:
+        httpd.shutdown()
+        if args.keep:
+            print('Exports and logs kept in ' + workdir)
+        else:
+            shutil.rmtree(workdir)
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'site': {'posts': args.posts, 'tags': args.tags, 'authors': args.authors, 'pages': args.pages},
+                       'buster_args': buster_args, 'results': results}, f, indent=2)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Compare the --replace-all HTML pipeline with the old double parse.
+
+The old pipeline parsed every page with lxml, serialized it, then parsed it
+again with BeautifulSoup's html5lib tree builder to prettify it before the
+text substitutions. The current one serializes the lxml tree once and goes
+straight to the substitutions. Both run the fix methods of an Exporter on
+the same corpus: Exporter.fixAllUrls() as it is, and the old pipeline made
+of its fixTagsOnly() and replace_all_urls() with the html5lib pass in between.
+
+    $ python3 bench/bench_replace_all.py [--corpus dir/with/html/pages]
+
+Without --corpus, pages rendered by fake_ghost.py are used. For real Ghost
+pages, point --corpus at a directory of pages saved from a Ghost blog before
+buster processed them. The old pipeline needs beautifulsoup4 and html5lib.
+"""
+
+import argparse
+import contextlib
+import os
+import re
+import sys
+import tempfile
+import time
+from pathlib import PurePath
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'buster'))
+
+from exporter import Exporter
+import fake_ghost
+
+SOURCE = 'http://localhost:2368'
+TARGET = 'https://example.com'
+RENAMED = ['screen.css', 'jquery.fitvids.js', 'header.jpg']
+RELPATH = PurePath('index.html')
+
+
+def load_corpus(corpus, pages):
+    if corpus is None:
+        site = fake_ghost.Site(SOURCE, posts=pages)
+        documents = [site.render_entry(post) for post in site.posts]
+        documents.append(site.render_listing('/', 'Fake Ghost', site.sorted_posts(), 1))
+        return documents
+    documents = []
+    for root, dirs, filenames in os.walk(corpus):
+        for filename in sorted(filenames):
+            if filename.endswith('.html'):
+                with open(os.path.join(root, filename), encoding='utf-8') as f:
+                    documents.append(f.read())
+    return documents
+
+
+def make_exporter(static_path):
+    """An Exporter set up to fix pages like a --replace-all export into
+    static_path."""
+    exporter = Exporter(SOURCE, TARGET, replace=True)
+    exporter.start(static_path)
+    exporter.start_fix(RENAMED)
+    return exporter
+
+
+def old_pipeline(exporter, data):
+    data = exporter.fixTagsOnly(RELPATH, data, 'html')
+    data = BeautifulSoup(data, "html5lib").prettify(formatter="minimal")
+    return exporter.replace_all_urls(data)
+
+
+def new_pipeline(exporter, data):
+    return exporter.fixAllUrls(RELPATH, data, 'html')
+
+
+def run(pipeline, exporter, documents, repeat):
+    best = None
+    # the fix methods print every page they fix
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for data in documents:
+                out = pipeline(exporter, data)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the --replace-all HTML pipeline.')
+    parser.add_argument('--corpus', help='Directory of HTML pages (default: pages rendered by fake_ghost.py)')
+    parser.add_argument('--pages', type=int, default=200, help='Number of fake posts when no corpus is given')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per pipeline; the best one is reported')
+    args = parser.parse_args()
+
+    documents = load_corpus(args.corpus, args.pages)
+    size = sum(len(d.encode()) for d in documents)
+    print('{} pages, {:.1f} MB'.format(len(documents), size / 1e6))
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='buster-bench-') as static_path:
+        exporter = make_exporter(static_path)
+        for name, pipeline in (('lxml + html5lib', old_pipeline), ('lxml only', new_pipeline)):
+            elapsed, sample = run(pipeline, exporter, documents, args.repeat)
+            results[name] = elapsed
+            print('{:16} {:8.3f} s  {:8.1f} pages/s  {:6.2f} ms/page'.format(
+                name, elapsed, len(documents) / elapsed, 1000 * elapsed / len(documents)))
+            if re.search(r'&#\d+;|&#x[0-9a-f]+;', sample, flags=re.IGNORECASE):
+                print('  warning: output contains numeric character references', file=sys.stderr)
+    print('speedup: {:.1f}x'.format(results['lxml + html5lib'] / results['lxml only']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Time the start-up of the buster command.
+
+buster.py is run with arguments that do no work (--version and the help of
+every action) --repeat times, and the median wall time of each is reported
+next to the start-up of a bare interpreter. The modules each one imported
+are found with python -X importtime, and any of HEAVY_MODULES among them is
+listed, since none of these commands need them.
+
+    $ python3 bench/bench_startup.py [--repeat 20] [--max-ms 100] [--json results.json]
+
+Exits with status 1 if a command imported a heavy module or, with --max-ms,
+took longer than that on top of the interpreter's own start-up, so it can
+be used as a regression check.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BUSTER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'buster', 'buster.py')
+
+COMMANDS = (
+    ('--version', ['--version']),
+    ('-h', ['-h']),
+    ('generate -h', ['generate', '-h']),
+    ('preview -h', ['preview', '-h']),
+)
+
+# modules only the work of an action needs
+HEAVY_MODULES = ('lxml', 'http.client', 'http.server', 'subresource_integrity', 'brotli', 'exporter', 'preview')
+
+
+def wall_ms(args, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def imported_modules(args):
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            name = line.rsplit('|', 1)[1].strip()
+            if name != 'package':
+                modules.add(name)
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the start-up time of buster.')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs per command; the median is reported')
+    parser.add_argument('--max-ms', type=float, help='Fail if a command takes longer than this on top of the interpreter')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    interpreter = wall_ms([sys.executable, '-c', 'pass'], args.repeat)
+    print('{:16} {:8.1f} ms'.format('python', interpreter))
+    results = {'python': interpreter, 'commands': {}}
+    failed = False
+    for name, command_args in COMMANDS:
+        ms = wall_ms([sys.executable, BUSTER] + command_args, args.repeat)
+        modules = imported_modules([BUSTER] + command_args)
+        heavy = [module for module in HEAVY_MODULES if module in modules]
+        results['commands'][name] = {'ms': ms, 'heavy_modules': heavy}
+        print('{:16} {:8.1f} ms  (+{:.1f} ms){}'.format(name, ms, ms - interpreter, '  imports ' + ', '.join(heavy) if heavy else ''))
+        if heavy or (args.max_ms is not None and ms - interpreter > args.max_ms):
+            failed = True
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Compare the url rewriter with the per-call re.sub it replaced.
+
+The attribute values buster rewrites (hrefs, :url meta tags and JSON-LD
+strings) are collected from a corpus of pages and rewritten both ways: with
+re.sub calls on patterns built at every call, as fixTagsOnly used to do, and
+with a UrlRewriter built once. The results are checked to be the same.
+
+    $ python3 bench/bench_url_rewriter.py [--corpus dir/with/html/pages]
+
+Without --corpus, pages rendered by fake_ghost.py are used.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from lxml import etree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'buster'))
+
+from urlrewriter import UrlRewriter
+import fake_ghost
+
+SOURCE = 'http://localhost:2368'
+TARGET = 'https://example.com'
+
+abs_url_regex = re.compile(r'^(?:[a-z]+:)?//', flags=re.IGNORECASE)
+
+
+def load_corpus(corpus, pages):
+    if corpus is None:
+        site = fake_ghost.Site(SOURCE, posts=pages)
+        documents = [site.render_entry(post) for post in site.posts]
+        documents.append(site.render_listing('/', 'Fake Ghost', site.sorted_posts(), 1))
+        return documents
+    documents = []
+    for root, dirs, filenames in os.walk(corpus):
+        for filename in sorted(filenames):
+            if filename.endswith('.html'):
+                with open(os.path.join(root, filename), encoding='utf-8') as f:
+                    documents.append(f.read())
+    return documents
+
+
+def collect_values(documents):
+    """Returns the hrefs and the absolute urls (meta, JSON-LD) of the pages,
+    in document order."""
+    hrefs = []
+    urls = []
+
+    def strings(o):
+        for value in o.values():
+            if isinstance(value, str):
+                urls.append(value)
+            elif isinstance(value, dict):
+                strings(value)
+
+    for data in documents:
+        root = etree.fromstring(data.encode(), etree.HTMLParser(encoding='utf-8'))
+        for el in root.xpath('//*[@href]'):
+            hrefs.append(el.attrib['href'])
+        for el in root.xpath('/html/head//meta[@name or @property][@content]'):
+            if re.search(':url$', el.attrib['name'] if 'name' in el.attrib else el.attrib['property']):
+                urls.append(el.attrib['content'])
+        for el in root.xpath('/html/head/script[@type="application/ld+json"]'):
+            strings(json.loads(el.text))
+    return hrefs, urls
+
+
+def old_rewrite(hrefs, urls):
+    source_url_regex = re.compile('^' + re.escape(SOURCE))
+    out = []
+    for href in hrefs:
+        if not abs_url_regex.search(href):
+            href = re.sub(r'(/|^)rss/index\.html$', r'\1rss/index.xml', href)
+            href = re.sub(r'(/|^)index\.html$', r'\1', href)
+        else:
+            href = re.sub(re.escape(SOURCE), lambda _: TARGET, href)
+            href = re.sub(re.escape(TARGET) + '((?:/[^?&]+)?)/rss/([?&]|$)', lambda m: TARGET + m.group(1) + '/rss/index.xml' + m.group(2), href)
+        out.append(href)
+    for url in urls:
+        out.append(re.sub(source_url_regex, lambda _: TARGET, url))
+    return out
+
+
+def new_rewrite(hrefs, urls):
+    rewriter = UrlRewriter(SOURCE, TARGET)
+    out = []
+    for href in hrefs:
+        out.append(rewriter.href(href, bool(abs_url_regex.search(href))))
+    for url in urls:
+        out.append(rewriter.absolute(url))
+    return out
+
+
+def run(rewrite, hrefs, urls, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = rewrite(hrefs, urls)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the url rewriter.')
+    parser.add_argument('--corpus', help='Directory of HTML pages (default: pages rendered by fake_ghost.py)')
+    parser.add_argument('--pages', type=int, default=200, help='Number of fake posts when no corpus is given')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per rewriter; the best one is reported')
+    args = parser.parse_args()
+
+    hrefs, urls = collect_values(load_corpus(args.corpus, args.pages))
+    count = len(hrefs) + len(urls)
+    print('{} values ({} hrefs, {} urls), {} distinct'.format(count, len(hrefs), len(urls), len(set(hrefs) | set(urls))))
+    results = {}
+    outputs = {}
+    for name, rewrite in (('re.sub per call', old_rewrite), ('UrlRewriter', new_rewrite)):
+        elapsed, outputs[name] = run(rewrite, hrefs, urls, args.repeat)
+        results[name] = elapsed
+        print('{:16} {:8.3f} s  {:8.2f} us/value'.format(name, elapsed, 1e6 * elapsed / count))
+    if outputs['re.sub per call'] != outputs['UrlRewriter']:
+        print('error: the rewriters disagree', file=sys.stderr)
+        sys.exit(1)
+    print('speedup: {:.1f}x'.format(results['re.sub per call'] / results['UrlRewriter']))
+
+
+if __name__ == '__main__':
+    main()
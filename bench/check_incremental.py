@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""Check incremental exports against full ones.
+
+A fake_ghost.py site is served from this process and exported in full. Then
+the site is changed step by step (a post edited, a post added, posts deleted
+so the pagination shifts, then nothing) and after every step it is exported
+again with each of:
+
+    incremental   --incremental from the previous step's export
+    revalidate    --incremental --revalidate from the previous step's export
+    in-place      --incremental into the previous step's export itself
+
+and, for reference, in full into a new directory. Every incremental export
+must have the same directories and files, byte for byte, as the full export
+of the same step, and the exports they started from must still be as they
+were, since carried-over files are hardlinked to them.
+
+    $ python3 bench/check_incremental.py [--keep] [generate options...]
+
+Extra options are passed to every generate, e.g. --precompress or --jobs 4.
+Exits with status 1 if any export differs.
+"""
+
+import argparse
+import filecmp
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import fake_ghost
+
+BUSTER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'buster', 'buster.py')
+TARGET = 'https://example.com'
+# kept next to each export
+MANIFEST_SUFFIX = '.buster-manifest.json'
+
+MODES = (
+    ('incremental', []),
+    ('revalidate', ['--revalidate']),
+    ('in-place', []),
+)
+
+STEPS = (
+    ('edit', lambda site: site.edit_post(5, 'An edited title')),
+    ('add', lambda site: site.add_post()),
+    ('delete', lambda site: (site.delete_post(3), site.delete_post(3))),
+    ('no change', lambda site: None),
+)
+
+
+def generate(source, static_path, extra_args):
+    args = [sys.executable, BUSTER, 'generate', source, TARGET, '--path', static_path] + extra_args
+    with open(static_path.rstrip('/') + '.log', 'a') as log:
+        if subprocess.call(args, stdout=log, stderr=subprocess.STDOUT) != 0:
+            raise Exception('buster failed, see ' + static_path + '.log')
+
+
+def tree(static_path):
+    """The relative paths of the directories and files of an export."""
+    dirs = set()
+    files = set()
+    for root, dirnames, filenames in os.walk(static_path):
+        relroot = os.path.relpath(root, static_path)
+        dirs.update(os.path.normpath(os.path.join(relroot, name)) for name in dirnames)
+        files.update(os.path.normpath(os.path.join(relroot, name)) for name in filenames)
+    return dirs, files
+
+
+def differences(expected_path, static_path):
+    expected_dirs, expected_files = tree(expected_path)
+    dirs, files = tree(static_path)
+    diffs = []
+    diffs += ['missing directory ' + path for path in sorted(expected_dirs - dirs)]
+    diffs += ['extra directory ' + path for path in sorted(dirs - expected_dirs)]
+    diffs += ['missing ' + path for path in sorted(expected_files - files)]
+    diffs += ['extra ' + path for path in sorted(files - expected_files)]
+    for path in sorted(expected_files & files):
+        if not filecmp.cmp(os.path.join(expected_path, path), os.path.join(static_path, path), shallow=False):
+            diffs.append('different ' + path)
+    return diffs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check incremental exports of a changing fake Ghost site against full ones.')
+    parser.add_argument('--posts', type=int, default=40)
+    parser.add_argument('--tags', type=int, default=4)
+    parser.add_argument('--authors', type=int, default=2)
+    parser.add_argument('--keep', action='store_true', help="Don't delete the exports and logs")
+    args, buster_args = parser.parse_known_args()
+
+    workdir = tempfile.mkdtemp(prefix='buster-check-')
+    site = fake_ghost.Site('http://127.0.0.1:0', posts=args.posts, tags=args.tags, authors=args.authors)
+    httpd = fake_ghost.serve(site)
+    site.url = 'http://127.0.0.1:' + str(httpd.server_address[1])
+
+    failed = False
+    try:
+        full_path = os.path.join(workdir, 'full-0')
+        generate(site.url, full_path, buster_args)
+        previous = {}
+        for name, _ in MODES:
+            previous[name] = os.path.join(workdir, name + '-0')
+            shutil.copytree(full_path, previous[name], symlinks=True)
+            shutil.copy(full_path + MANIFEST_SUFFIX, previous[name] + MANIFEST_SUFFIX)
+        for i, (step, change) in enumerate(STEPS, 1):
+            change(site)
+            full_path = os.path.join(workdir, 'full-' + str(i))
+            generate(site.url, full_path, buster_args)
+            for name, mode_args in MODES:
+                if name == 'in-place':
+                    static_path = previous[name]
+                else:
+                    static_path = os.path.join(workdir, name + '-' + str(i))
+                generate(site.url, static_path, ['--incremental', previous[name]] + mode_args + buster_args)
+                previous[name] = static_path
+                diffs = differences(full_path, static_path)
+                print('{:10} {:12} {}'.format(step, name, 'ok' if not diffs else str(len(diffs)) + ' differences'))
+                for diff in diffs:
+                    print('    ' + diff)
+                failed = failed or bool(diffs)
+        # the exports the incremental ones started from must be left as they were
+        for i in range(len(STEPS)):
+            for name in ('incremental', 'revalidate'):
+                diffs = differences(os.path.join(workdir, 'full-' + str(i)), os.path.join(workdir, name + '-' + str(i)))
+                if diffs:
+                    print('{}-{} was changed by the next export'.format(name, i))
+                    for diff in diffs:
+                        print('    ' + diff)
+                    failed = True
+    finally:
+        httpd.shutdown()
+        if args.keep:
+            print('Exports and logs kept in ' + workdir)
+        else:
+            shutil.rmtree(workdir)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Check the link tokenizer of the crawler.
+
+rewrite_html_links() and rewrite_css_links() find the links the crawler
+follows and rewrites, without an HTML parser. Every case here gives a
+document, the links that must be found in it, in order, and the document
+after every /old in a link is replaced by /new. Links in comments and in the
+text of <script>, <title> and <textarea> must be left alone.
+
+    $ python3 bench/check_links.py
+
+Exits with status 1 if any case fails.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'buster'))
+
+from crawler import rewrite_css_links, rewrite_html_links
+
+# (name, document, links, rewritten document)
+HTML_CASES = (
+    ('double quotes', '<a href="/old/1">', ['/old/1'], '<a href="/new/1">'),
+    ('single quotes', "<a href='/old/1'>", ['/old/1'], "<a href='/new/1'>"),
+    ('no quotes', '<a href=/old/1>x</a>', ['/old/1'], '<a href="/new/1">x</a>'),
+    ('no quotes, trailing slash', '<a href=/old/1/>', ['/old/1/'], '<a href="/new/1/">'),
+    ('quote in unquoted value', "<a href=/old/it's class=x>", ["/old/it's"], '<a href="/new/it\'s" class=x>'),
+    ('spaces around =', '<a href = "/old/1">', ['/old/1'], '<a href = "/new/1">'),
+    ('upper case', '<A HREF="/old/1">', ['/old/1'], '<A HREF="/new/1">'),
+    ('> in another attribute', '<a title="a > b" href="/old/1">', ['/old/1'], '<a title="a > b" href="/new/1">'),
+    ('quote in quoted value', '<a href=\'/old/"1"\'>', ['/old/"1"'], '<a href=\'/new/"1"\'>'),
+    ('&amp;', '<a href="/old?a=1&amp;b=2">', ['/old?a=1&b=2'], '<a href="/new?a=1&amp;b=2">'),
+    ('numeric references', '<a href="/old/&#233;t&#xE9;">', ['/old/été'], '<a href="/new/été">'),
+    ('named reference', '<a href="/old/&eacute;t&eacute;">', ['/old/été'], '<a href="/new/été">'),
+    ('& in query string', '<a href="/old?a=1&copy=2&notify=3">', ['/old?a=1&copy=2&notify=3'], '<a href="/new?a=1&amp;copy=2&amp;notify=3">'),
+    ('unknown reference', '<a href="/old?a&notfound;">', ['/old?a&notfound;'], '<a href="/new?a&amp;notfound;">'),
+    ('not a link attribute', '<div href="/old/1" data-src="/old/2">', [], '<div href="/old/1" data-src="/old/2">'),
+    ('srcset', '<img src="/old/a.jpg" srcset="/old/a.jpg 1x, /old/b.jpg 2x,/old/c.jpg 600w">',
+     ['/old/a.jpg', '/old/a.jpg', '/old/b.jpg', '/old/c.jpg'],
+     '<img src="/new/a.jpg" srcset="/new/a.jpg 1x, /new/b.jpg 2x,/new/c.jpg 600w">'),
+    ('srcset without descriptors', '<source srcset="/old/a.jpg, /old/b.jpg">', ['/old/a.jpg', '/old/b.jpg'], '<source srcset="/new/a.jpg, /new/b.jpg">'),
+    ('srcset url with a comma', '<img srcset="/old/a,b.jpg 1x">', ['/old/a,b.jpg'], '<img srcset="/new/a,b.jpg 1x">'),
+    ('<style>',
+     '<style>body { background: url(/old/bg.png) } @import "/old/a.css"; @import url(\'/old/b.css\'); @import\'/old/c.css\';</style>',
+     ['/old/bg.png', '/old/a.css', '/old/b.css', '/old/c.css'],
+     '<style>body { background: url(/new/bg.png) } @import "/new/a.css"; @import url(\'/new/b.css\'); @import\'/new/c.css\';</style>'),
+    ('comment in <style>', '<style>/* url(/old/1.png) */ a { b: url("/old/2.png") }</style>',
+     ['/old/2.png'], '<style>/* url(/old/1.png) */ a { b: url("/new/2.png") }</style>'),
+    ('style attribute', '<div style="background: url(&quot;/old/x.png&quot;)">', ['/old/x.png'], '<div style="background: url(&quot;/new/x.png&quot;)">'),
+    ('comment', '<!-- <a href="/old/1"> --><a href="/old/2">', ['/old/2'], '<!-- <a href="/old/1"> --><a href="/new/2">'),
+    ('conditional comment', '<!--[if IE]><link href="/old/ie.css"><![endif]-->', [], '<!--[if IE]><link href="/old/ie.css"><![endif]-->'),
+    ('unclosed comment', '<a href="/old/1"><!-- <a href="/old/2">', ['/old/1'], '<a href="/new/1"><!-- <a href="/old/2">'),
+    ('<script> text', '<script src="/old/a.js">var s = \'<a href="/old/1">\'; document.write("<img src=/old/2>")</SCRIPT ><a href="/old/3">',
+     ['/old/a.js', '/old/3'], '<script src="/new/a.js">var s = \'<a href="/old/1">\'; document.write("<img src=/old/2>")</SCRIPT ><a href="/new/3">'),
+    ('<title> text', '<title><a href="/old/1"></title>', [], '<title><a href="/old/1"></title>'),
+    ('<textarea> text', '<textarea><img src="/old/1"></textarea><img src="/old/2">', ['/old/2'], '<textarea><img src="/old/1"></textarea><img src="/new/2">'),
+)
+
+# (name, document, href of <base> or None)
+BASE_CASES = (
+    ('<base>', '<base href="https://example.com/b/"><a href="/old/1">', 'https://example.com/b/'),
+    ('<base> without quotes', '<base href=/b/>', '/b/'),
+    ('<base> with &amp;', "<base href='/b/?a=1&amp;b=2'>", '/b/?a=1&b=2'),
+    ('<base> in a comment', '<!-- <base href="/b/"> -->', None),
+    ('<base> in a script', '<script>"<base href=/b/>"</script>', None),
+)
+
+CSS_CASES = (
+    ('url()', 'a { b: url(/old/1.png); c: url( "/old/2.png" ); d: url(\'/old/3.png\') }',
+     ['/old/1.png', '/old/2.png', '/old/3.png'],
+     'a { b: url(/new/1.png); c: url( "/new/2.png" ); d: url(\'/new/3.png\') }'),
+    ('upper case URL()', 'a { b: URL(/old/1.png) }', ['/old/1.png'], 'a { b: URL(/new/1.png) }'),
+    ('@import', '@import "/old/a.css";\n@import url(/old/b.css) screen;\n@import\'/old/c.css\';',
+     ['/old/a.css', '/old/b.css', '/old/c.css'],
+     '@import "/new/a.css";\n@import url(/new/b.css) screen;\n@import\'/new/c.css\';'),
+    ('comment', '/* a { b: url(/old/1.png) }\n@import "/old/a.css"; */ c { d: url(/old/2.png) }',
+     ['/old/2.png'], '/* a { b: url(/old/1.png) }\n@import "/old/a.css"; */ c { d: url(/new/2.png) }'),
+)
+
+
+def run(rewrite, text):
+    links = []
+
+    def fix(url):
+        links.append(url)
+        return url.replace('/old', '/new') if '/old' in url else None
+    return links, rewrite(text, fix)
+
+
+def check(name, links, expected_links, result, expected_result):
+    problems = []
+    if links != expected_links:
+        problems.append('links ' + repr(links) + ', expected ' + repr(expected_links))
+    if result != expected_result:
+        problems.append('rewritten to ' + repr(result) + ', expected ' + repr(expected_result))
+    print('{:32} {}'.format(name, 'ok' if not problems else 'FAILED'))
+    for problem in problems:
+        print('    ' + problem)
+    return not problems
+
+
+def main():
+    ok = True
+    for name, text, expected_links, expected_result in HTML_CASES:
+        links, result = run(rewrite_html_links, text)
+        ok = check('html: ' + name, links, expected_links, result, expected_result) and ok
+    for name, text, expected_base in BASE_CASES:
+        bases = []
+        rewrite_html_links(text, lambda url: None, bases.append)
+        expected_bases = [expected_base] if expected_base is not None else []
+        ok = check('html: ' + name, bases, expected_bases, None, None) and ok
+    for name, text, expected_links, expected_result in CSS_CASES:
+        links, result = run(rewrite_css_links, text)
+        ok = check('css: ' + name, links, expected_links, result, expected_result) and ok
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
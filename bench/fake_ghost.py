@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""A local stand-in for a Ghost origin, serving a synthetic site.
+
+The site has posts, static pages, tags, authors, paginated listings, RSS
+feeds, sitemaps with lastmod dates, JSON-LD, the ghost-sdk scripts and
+query-string theme assets, so buster can be run against it without a Ghost
+installation:
+
+    $ python3 bench/fake_ghost.py --posts 500 --port 2368
+"""
+
+import argparse
+import hashlib
+import html
+import json
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+POSTS_PER_PAGE = 5
+RSS_ITEMS = 15
+ASSET_VERSION = 'a1b2c3d4e5'
+
+LOREM = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+         'incididunt ut labore et dolore magna aliqua ut enim ad minim veniam quis nostrud '
+         'exercitation ullamco laboris nisi ut aliquip ex ea commodo consequat '
+         'café naïve résumé über – “quoted” 日本語').split()
+
+SCREEN_CSS = '''body { background: url(../images/bg.png); font-family: sans-serif; }
+@import "fonts.css";
+.site-header { background-image: url("/assets/images/header.jpg?v=''' + ASSET_VERSION + '''"); }
+'''
+
+
+class Site:
+    """The content of the fake blog. Mutate it with edit_post(),
+    add_post() and delete_post() while the server is running."""
+
+    def __init__(self, url, posts=100, tags=10, authors=3, pages=3, paragraphs=8, external_script=None, seed=0):
+        self.url = url.rstrip('/')
+        self.external_script = external_script
+        self.lock = threading.Lock()
+        rng = random.Random(seed)
+        self.rng = rng
+        self.paragraphs = paragraphs
+        start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        self.tags = [{'slug': 'tag-' + str(i), 'name': 'Tag ' + str(i), 'updated': start} for i in range(tags)]
+        self.authors = [{'slug': 'author-' + str(i), 'name': 'Author ' + str(i), 'updated': start} for i in range(authors)]
+        self.pages = [self._new_entry('page-' + str(i), start + timedelta(hours=i)) for i in range(pages)]
+        self.posts = []
+        for i in range(posts):
+            self.add_post(start + timedelta(hours=i))
+
+    def _new_entry(self, slug, published):
+        rng = self.rng
+        return {
+            'slug': slug,
+            'title': ' '.join(rng.choice(LOREM) for _ in range(6)).capitalize(),
+            'published': published,
+            'updated': published,
+            'tags': rng.sample(self.tags, min(2, len(self.tags))),
+            'author': rng.choice(self.authors),
+            'body': [' '.join(rng.choice(LOREM) for _ in range(60)) for _ in range(self.paragraphs)],
+        }
+
+    def add_post(self, published=None):
+        with self.lock:
+            if published is None:
+                published = max(p['published'] for p in self.posts) + timedelta(hours=1)
+            post = self._new_entry('post-' + str(len(self.posts)), published)
+            self.posts.append(post)
+            return post
+
+    def edit_post(self, index, title):
+        with self.lock:
+            post = self.posts[index]
+            post['title'] = title
+            post['updated'] = post['updated'] + timedelta(days=1)
+
+    def delete_post(self, index):
+        with self.lock:
+            del self.posts[index]
+
+    def sorted_posts(self, predicate=None):
+        posts = [p for p in self.posts if predicate is None or predicate(p)]
+        return sorted(posts, key=lambda p: p['published'], reverse=True)
+
+    # rendering
+
+    def _head(self, title, canonical, rss, ld):
+        external = ''
+        if self.external_script is not None:
+            external = '<script src="{}" integrity="{}" crossorigin="anonymous"></script>\n'.format(*self.external_script)
+        return '''<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="utf-8" />
+    <title>{title}</title>
+    <link rel="stylesheet" type="text/css" href="/assets/css/screen.css?v={v}" />
+    <link rel="shortcut icon" href="/favicon.png" type="image/png" />
+    <link rel="canonical" href="{canonical}" />
+    <meta name="referrer" content="no-referrer-when-downgrade" />
+    <meta property="og:url" content="{canonical}" />
+    <meta name="twitter:url" content="{canonical}" />
+    <script type="application/ld+json">
+{ld}
+    </script>
+    <script type="text/javascript" src="/public/ghost-sdk.min.js?v={v}"></script>
+    <script type="text/javascript">
+    ghost.init({{
+        clientId: "ghost-frontend",
+        clientSecret: "0123456789ab"
+    }});
+    </script>
+    {external}<meta name="generator" content="Ghost 1.22" />
+    <link rel="alternate" type="application/rss+xml" title="Fake Ghost" href="{rss}" />
+</head>
+'''.format(title=html.escape(title), v=ASSET_VERSION, canonical=canonical, rss=rss,
+           ld=json.dumps(ld, indent=4), external=external)
+
+    def _nav(self):
+        return '''<nav class="site-nav">
+    <a href="{url}/">Home</a>
+    <a href="{url}/tag/{tag}/">{tagname}</a>
+    <a href="{url}/{page}/">About</a>
+    <a href="https://twitter.com/share?text=Fake&amp;url={url}/">Share</a>
+    <a href="https://feedly.com/i/subscription/feed/{url}/rss/">Feedly</a>
+</nav>
+'''.format(url=self.url, tag=self.tags[0]['slug'], tagname=self.tags[0]['name'],
+           page=self.pages[0]['slug'] if self.pages else '')
+
+    def _footer(self):
+        return '''<footer><img src="/content/images/logo.png" srcset="/content/images/logo.png 1x, /content/images/logo@2x.png 2x" alt="">
+<script type="text/javascript" src="/assets/js/jquery.fitvids.js?v={v}"></script>
+</footer>
+</body>
+</html>
+'''.format(v=ASSET_VERSION)
+
+    def render_entry(self, entry):
+        url = self.url + '/' + entry['slug'] + '/'
+        ld = {'@context': 'https://schema.org', '@type': 'Article', 'url': url, 'headline': entry['title'],
+              'publisher': {'@type': 'Organization', 'name': 'Fake Ghost', 'logo': self.url + '/content/images/logo.png'},
+              'author': {'@type': 'Person', 'name': entry['author']['name'], 'url': self.url + '/author/' + entry['author']['slug'] + '/'}}
+        tags = ''.join('<a href="/tag/{}/">{}</a> '.format(t['slug'], t['name']) for t in entry['tags'])
+        body = ''.join('<p>{}</p>\n'.format(p) for p in entry['body'])
+        return (self._head(entry['title'], url, self.url + '/rss/', ld) +
+                '<body class="post-template">\n' + self._nav() +
+                '<article><h1>{}</h1>\n<div class="tags">{}</div>\n<a href="/author/{}/">{}</a>\n'.format(
+                    html.escape(entry['title']), tags, entry['author']['slug'], entry['author']['name']) +
+                '<img src="/content/images/{}.jpg" alt="">\n'.format(entry['slug']) +
+                body + '</article>\n' + self._footer())
+
+    def render_listing(self, base, title, posts, page):
+        pages = max(1, (len(posts) + POSTS_PER_PAGE - 1) // POSTS_PER_PAGE)
+        if page > pages:
+            return None
+        shown = posts[(page - 1) * POSTS_PER_PAGE:page * POSTS_PER_PAGE]
+        canonical = self.url + base + ('page/' + str(page) + '/' if page > 1 else '')
+        ld = {'@context': 'https://schema.org', '@type': 'WebSite', 'url': canonical, 'name': title}
+        items = ''.join('<article><h2><a href="/{0}/">{1}</a></h2><p>{2}</p></article>\n'.format(
+            p['slug'], html.escape(p['title']), p['body'][0][:200]) for p in shown)
+        pagination = ''
+        if page > 1:
+            pagination += '<a class="newer-posts" href="{}">Newer</a>'.format(base if page == 2 else base + 'page/' + str(page - 1) + '/')
+        if page < pages:
+            pagination += '<a class="older-posts" href="{}page/{}/">Older</a>'.format(base, page + 1)
+        return (self._head(title, canonical, self.url + base + 'rss/', ld) +
+                '<body class="home-template">\n' + self._nav() + items +
+                '<nav class="pagination">' + pagination + '</nav>\n' + self._footer())
+
+    def render_rss(self, base, title, posts):
+        items = ''.join('''<item><title><![CDATA[{title}]]></title><description><![CDATA[<p>{desc}</p>]]></description><link>{url}/{slug}/</link><guid isPermaLink="false">{slug}</guid><dc:creator><![CDATA[{author}]]></dc:creator><pubDate>{date}</pubDate><content:encoded><![CDATA[{content}]]></content:encoded></item>'''.format(
+            title=p['title'], desc=p['body'][0][:200], url=self.url, slug=p['slug'], author=p['author']['name'],
+            date=p['published'].strftime('%a, %d %b %Y %H:%M:%S GMT'),
+            content=''.join('<p>{}</p>'.format(b) for b in p['body'])) for p in posts[:RSS_ITEMS])
+        return '''<?xml version="1.0" encoding="UTF-8"?><rss xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:content="http://purl.org/rss/1.0/modules/content/" xmlns:atom="http://www.w3.org/2005/Atom" version="2.0" xmlns:media="http://search.yahoo.com/mrss/"><channel><title><![CDATA[{title}]]></title><description><![CDATA[Thoughts, stories and ideas.]]></description><link>{url}/</link><image><url>{url}/favicon.png</url><title>{title}</title><link>{url}/</link></image><generator>Ghost 1.22</generator><lastBuildDate>Mon, 01 Jan 2020 00:00:00 GMT</lastBuildDate><atom:link href="{url}{base}rss/" rel="self" type="application/rss+xml"/><ttl>60</ttl>{items}</channel></rss>'''.format(
+            title=title, url=self.url, base=base, items=items)
+
+    def render_sitemap(self, entries):
+        urls = ''.join('<url><loc>{}</loc><lastmod>{}</lastmod></url>'.format(
+            loc, lastmod.strftime('%Y-%m-%dT%H:%M:%S.000Z')) for loc, lastmod in entries)
+        return ('<?xml version="1.0" encoding="UTF-8"?><?xml-stylesheet type="text/xsl" href="//localhost/sitemap.xsl"?>'
+                '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">' +
+                urls + '</urlset>')
+
+    def render(self, path):
+        """Returns (status, content type, body, location)."""
+        with self.lock:
+            return self._render(path)
+
+    def _render(self, path):
+        if path == '/favicon.png':
+            return 301, None, b'', self.url + '/favicon.ico'
+        if path == '/robots.txt':
+            return 200, 'text/plain', 'User-agent: *\nSitemap: {0}/sitemap.xml\nDisallow: /ghost/\nDisallow: /p/\n'.format(self.url), None
+        if path == '/sitemap.xml':
+            body = ('<?xml version="1.0" encoding="UTF-8"?><sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">' +
+                    ''.join('<sitemap><loc>{}/sitemap-{}.xml</loc></sitemap>'.format(self.url, kind) for kind in ('pages', 'posts', 'authors', 'tags')) +
+                    '</sitemapindex>')
+            return 200, 'text/xml', body, None
+        if path == '/sitemap-posts.xml':
+            return 200, 'text/xml', self.render_sitemap((self.url + '/' + p['slug'] + '/', p['updated']) for p in self.sorted_posts()), None
+        if path == '/sitemap-pages.xml':
+            return 200, 'text/xml', self.render_sitemap((self.url + '/' + p['slug'] + '/', p['updated']) for p in self.pages), None
+        if path == '/sitemap-tags.xml':
+            return 200, 'text/xml', self.render_sitemap((self.url + '/tag/' + t['slug'] + '/', t['updated']) for t in self.tags), None
+        if path == '/sitemap-authors.xml':
+            return 200, 'text/xml', self.render_sitemap((self.url + '/author/' + a['slug'] + '/', a['updated']) for a in self.authors), None
+        if path.startswith('/assets/') or path.startswith('/content/images/') or path.startswith('/public/') or path == '/favicon.ico':
+            if path.endswith('.css'):
+                return 200, 'text/css', SCREEN_CSS if path.endswith('screen.css') else 'body { color: black; }\n', None
+            if path.endswith('.js'):
+                return 200, 'application/javascript', '(function(){ var x = 1; })();\n' * 20, None
+            return 200, 'image/png', b'\x89PNG\r\n\x1a\n' + path.encode() * 50, None
+
+        parts = [p for p in path.split('/') if p]
+        if not path.endswith('/'):
+            return 301, None, b'', self.url + path + '/'
+
+        def collection(base, title, posts, rest):
+            if rest == []:
+                return self.render_listing(base, title, posts, 1)
+            if rest == ['rss']:
+                return self.render_rss(base, title, posts)
+            if len(rest) == 2 and rest[0] == 'page' and rest[1].isdigit() and int(rest[1]) > 1:
+                return self.render_listing(base, title, posts, int(rest[1]))
+            return None
+
+        body = None
+        content_type = 'text/html'
+        if parts == [] or parts[0] in ('page', 'rss'):
+            body = collection('/', 'Fake Ghost', self.sorted_posts(), parts)
+        elif parts[0] == 'tag' and len(parts) >= 2:
+            tag = next((t for t in self.tags if t['slug'] == parts[1]), None)
+            if tag is not None:
+                body = collection('/tag/' + tag['slug'] + '/', tag['name'], self.sorted_posts(lambda p: tag in p['tags']), parts[2:])
+        elif parts[0] == 'author' and len(parts) >= 2:
+            author = next((a for a in self.authors if a['slug'] == parts[1]), None)
+            if author is not None:
+                body = collection('/author/' + author['slug'] + '/', author['name'], self.sorted_posts(lambda p: p['author'] is author), parts[2:])
+        elif len(parts) == 1:
+            entry = next((p for p in self.posts + self.pages if p['slug'] == parts[0]), None)
+            if entry is not None:
+                body = self.render_entry(entry)
+        if body is not None and parts[-1:] == ['rss']:
+            content_type = 'text/xml'
+        if body is None:
+            return 404, 'text/html', '<html><body>Not found</body></html>', None
+        return 200, content_type, body, None
+
+
+def make_handler(site):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # headers and body are written separately; like Ghost, don't let
+        # Nagle's algorithm hold the body back
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            status, content_type, body, location = site.render(urlsplit(self.path).path)
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            # like Express, Ghost sends a weak ETag and honors If-None-Match
+            etag = None
+            if status == 200:
+                etag = 'W/"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    status, body = 304, b''
+            self.send_response(status)
+            if etag is not None:
+                self.send_header('ETag', etag)
+            if location is not None:
+                self.send_header('Location', location)
+            if content_type is not None:
+                self.send_header('Content-Type', content_type + ('; charset=utf-8' if content_type.startswith('text/') else ''))
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+    return Handler
+
+
+def serve(site, port=0):
+    """Start serving site in a background thread. Returns the server; its
+    port is server.server_address[1]."""
+    httpd = ThreadingHTTPServer(('127.0.0.1', port), make_handler(site))
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a synthetic Ghost site.')
+    parser.add_argument('--port', type=int, default=2368)
+    parser.add_argument('--posts', type=int, default=100)
+    parser.add_argument('--tags', type=int, default=10)
+    parser.add_argument('--authors', type=int, default=3)
+    parser.add_argument('--pages', type=int, default=3)
+    args = parser.parse_args()
+    site = Site('http://localhost:' + str(args.port), posts=args.posts, tags=args.tags, authors=args.authors, pages=args.pages)
+    httpd = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(site))
+    print('Serving fake Ghost site at ' + site.url)
+    httpd.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,11 @@
 """Ghost Buster. Static site generator for Ghost.
 """
 
-import os
-import subprocess
-from pathlib import PurePath, PurePosixPath
-import re
-import json
+# Only what every action needs is imported here, the rest is imported by
+# the action using it, so that --version, -h and preview start quickly.
 import sys
-import fnmatch
-from glob import iglob
-import shutil
-from itertools import chain
-from http.server import HTTPServer, SimpleHTTPRequestHandler
-from time import gmtime, strftime
-from io import StringIO, BytesIO
-from bs4 import BeautifulSoup
-from lxml import etree, html
-import subresource_integrity
 import argparse
 import _version
-from normpath import normpath
 
 def main():
 
@@ -53,6 +39,15 @@ def main():
     generate_parser.add_argument('--header', dest='headers', action='append', nargs=1, help='Extra header to include in requests')
     generate_parser.add_argument('--user', dest='user', action='store', nargs=1, help='HTTP user')
     generate_parser.add_argument('--password', dest='password', action='store', nargs=1, help='HTTP password')
+    generate_parser.add_argument('--incremental', dest='previous_path', action='store', metavar='previous/dir', help='Start from the export in previous/dir and only download what changed since, according to the sitemaps (may be the same as --path)')
+    generate_parser.add_argument('--revalidate', dest='revalidate', action='store_true', help='With --incremental, crawl the whole site like a full export, but keep the files of the previous export that the source says are unchanged')
+    generate_parser.add_argument('--concurrency', dest='concurrency', action='store', type=int, default=4, metavar='N', help='Number of concurrent requests to the source (default: 4)')
+    generate_parser.add_argument('--link-dest', dest='link_dest', action='store', metavar='reference/dir', help='Hardlink files identical to ones in reference/dir, such as a previous export, instead of keeping a copy')
+    generate_parser.add_argument('--precompress', dest='precompress', action='store_true', help='Write gzip (and brotli, if installed) compressed copies of text files next to them')
+    generate_parser.add_argument('--stats-file', dest='stats_file', action='store', metavar='stats.json', help='Write the time spent and files handled in each stage as JSON')
+    generate_parser.add_argument('--script-cache', dest='script_cache', action='store', metavar='cache/dir', help='Keep the external scripts pinned by an integrity attribute in cache/dir and reuse them across exports')
+    generate_parser.add_argument('--sync', dest='sync', action='store_true', help='Flush the export to disk before exiting')
+    generate_parser.add_argument('--jobs', '-j', dest='jobs', action='store', type=int, default=1, metavar='N', help='Number of processes fixing links in HTML and XML files and compressing files (default: 1)')
     # replacement switch
     generate_parser.add_argument('--replace-all', '-a', dest='replace', action='store_true', help='Replace all occurences of source-url, not just in link attributes')
 
@@ -60,6 +55,9 @@ def main():
     preview_parser = subparsers.add_parser('preview', help='Local preview', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     preview_parser._optionals.title = "options"
     preview_parser.add_argument('-p', '--path', action='store', dest='static_path', default='static', metavar='output/dir', nargs="?", help='Output path of local directory to store static pages. (default: static)')
+    preview_parser.add_argument('--port', dest='port', action='store', type=int, default=9000, help='Port to listen on')
+    preview_parser.add_argument('--cache-size', dest='cache_size', action='store', type=int, default=64, metavar='MB', help='Memory used to cache files')
+    preview_parser.add_argument('--threads', dest='threads', action='store', type=int, default=16, metavar='N', help='Connections handled at once, more wait')
 
 # Deploy command
     deploy_parser = subparsers.add_parser('deploy', help='Deploy to Github pages', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -78,271 +76,44 @@ def main():
         parser.print_help()
         sys.exit(1)
     args=parser.parse_args()
+    if getattr(args, 'revalidate', False) and args.previous_path is None:
+        parser.error('--revalidate requires --incremental')
 
     print("Running: buster " + args.current_action)
 
-    extra_wget_options = []
-    for header in args.headers or []:
-        extra_wget_options.append('--header')
-        extra_wget_options.append(header[0])
-    if args.user is not None:
-        extra_wget_options.append('--user')
-        extra_wget_options.append(args.user[0])
-    if args.password is not None:
-        extra_wget_options.append('--password')
-        extra_wget_options.append(args.password[0])
-
     # simplify comparison
     action = args.current_action
 
 
     if action == 'generate':
-        def download_paths(relpaths):
-            if len(relpaths) == 0:
-                return
-            command = (
-                "wget",
-                "--level=0",               # keep following links
-                "--recursive",             # follow links to download entire site
-                "--convert-links",         # make links relative
-                "--page-requisites",       # grab everything: css / inlined images
-                "--no-parent",             # don't go to parent level
-                "--directory-prefix", args.static_path, # download contents to static/ folder
-                "--no-host-directories",   # don't create domain named folder
-                "--restrict-file-name=unix", # don't escape query string
-                *extra_wget_options,
-                *(args.source + x for x in relpaths)
-            )
-            subprocess.run(command, check=True)
-
-        def download_one_file_to_destination(url, destination):
-            command = (
-                "wget",
-                "-O", destination,
-                "--restrict-file-name=unix",
-                *extra_wget_options,
-                url
-            )
-            subprocess.run(command, check=True)
-
-        download_paths((
-            '',
-            '/robots.txt',
-            '/sitemap.xml',
-            '/sitemap-pages.xml',
-            '/sitemap-posts.xml',
-            '/sitemap-authors.xml',
-            '/sitemap-tags.xml'
-        ))
-
-        more_rss_paths = []
-        for dir in ['tag', 'author']:
-            sdir = os.path.join(args.static_path, dir)
-            if os.path.isdir(sdir):
-                for subdir in os.listdir(sdir):
-                    more_rss_paths.append('/' + dir + '/' + subdir + '/rss/')
-        download_paths(more_rss_paths)
-
-        for filename in iglob(os.path.join(args.static_path, 'public', 'ghost-sdk*.js*')):
-            os.remove(filename)
-
-        # init list of renamed files
-        files = []
-        # remove query string since Ghost 0.4
-        for root, dirs, filenames in os.walk(args.static_path):
-            for filename in fnmatch.filter(filenames, '*[?]*'):
-                newname = re.sub(r'\?.*', '', filename)
-                print("Rename " + filename + " => " + newname)
-                os.rename(os.path.join(root, filename), os.path.join(root, newname))
-                files.append(newname) # add new name to file-list
-
-        # remove superfluous "index.html" from relative hyperlinks found in text
-        abs_url_regex = re.compile(r'^(?:[a-z]+:)?//', flags=re.IGNORECASE)
-
-        # form regex from file-list (i.e. all files, with stripped arguments from above)
-        url_suffix_regex = re.compile(r'(' + "|".join(files) + r')(\?.*?(?=\"))', flags = re.IGNORECASE)
-
-        source_url_regex = re.compile('^' + re.escape(args.source))
-
-        # The URLs of all external files we've internalized
-        downloaded_external_scripts = set()
-
-        def calculate_sri(filename, hash):
-            with open(filename, 'rb') as f:
-                data = f.read()
-            return str(list(subresource_integrity.generate(data, [hash]))[0])
-
-        def repl(m): # select regex matching group
-            print("---Removing " + m.group(2) + " from " + m.group(1))
-            return m.group(1)
-
-        def fixAllUrls(relpath, data, kind):
-            # step 1:
-            # load HTML/XML in lxml
-            if kind == "xml": # parser for XML that keeps CDATA elements (beautifulsoup doesn't)
-                print("Fixing XML")
-                parser = etree.XMLParser(encoding='utf-8', strip_cdata=False, resolve_entities=True)
-                data = etree.XML(data.encode(), parser)
-                # format the parsed xml for output (keep all non-ascii chars inside CDATA)
-                data = etree.tostring(data, pretty_print=True, encoding="utf-8", xml_declaration=True).decode()
-            elif kind == "html": # parser for HTML ("lenient" setting for html5)
-                print("Fixing HTML")
-
-                # the following should work, but spits out utf-8 numeric character references...
-                # TODO: FIXME
-                # parser = etree.HTMLParser(strip_cdata=False)
-                # if isinstance(data, str):
-                #     data = unicode(data, "utf-8")
-                # data = etree.parse(StringIO(data), parser)
-                # data = html.tostring(data.getroot(), pretty_print=True, method="html")
-                # data = u'<!DOCTYPE html>\n' + unicode(data)
-
-                # go through fixTagsOnly (we'll be calling bs4 twice until above is fixed...)
-                data = fixTagsOnly(relpath, data, kind)
-
-                # BeautifulSoup outputs html entities with formatter="html" (if you need them).
-                # lxml above should be faster, but outputs utf-8 numeric char refs
-                print("Fixing remaining links")
-                data = BeautifulSoup(data, "html5lib").prettify(formatter="minimal")
-
-            # step 2:
-            # substitute all occurences of --source-url (args.source) argument with --target-url (args.target)
-            data = re.sub(re.escape(args.source), lambda _: args.target, data)
-
-            # step 3:
-            # remove URL arguments (e.g. query string) from renamed files
-            # TODO: make it work with googlefonts
-            data = url_suffix_regex.sub(repl, data)
-            return data
-
-        def fixTagsOnly(relpath, data, kind):
-            print("Fixing tags")
-            if kind == 'xml':
-                parser = etree.XMLParser(encoding='utf-8', strip_cdata=False, resolve_entities=True)
-                root = etree.fromstring(data.encode(), parser)
-
-                for el in root.xpath('//*[self::link or self::url or local-name()="loc"]'):
-                    el.text = re.sub(source_url_regex, lambda _: args.target, el.text)
-                    # /favicon.png is a redirect in ghost, so no favicon.png exists.
-                    if el.text == args.target + '/favicon.png':
-                        el.text = args.target + '/favicon.ico'
-                for el in root.xpath('//*[@href]'):
-                    el.attrib['href'] = re.sub(source_url_regex, lambda _: args.target, el.attrib['href'])
-                for el in root.xpath('//*[local-name()="link" and namespace-uri()="http://www.w3.org/2005/Atom" and @href and @rel="self" and @type="application/rss+xml"]'):
-                    el.attrib['href'] = re.sub(r'/rss/$', '/rss/index.xml', el.attrib['href'])
-
-                return etree.tostring(root, encoding='utf-8', pretty_print=True, xml_declaration=True).decode()
-            elif kind == 'html':
-                parser = etree.HTMLParser(encoding='utf-8')
-                root = etree.fromstring(data.encode(), parser)
-
-                # Remove ghost API javascript. Static files don't need this.
-                for el in root.xpath('//script[@type="text/javascript"][contains(@src,"public/ghost-sdk.")][contains(@src,".js")]'):
-                    el.getparent().remove(el)
-                for el in root.xpath('//script[@type="text/javascript"][not(@src)]'):
-                    if re.match(r'\s*ghost\.init\(', el.text):
-                        el.getparent().remove(el)
-
-                # Copy any remote static (has integrity attr) javascript files to be local
-                for el in root.xpath('//script[@integrity][starts-with(@src,"https:")]'):
-                    src = el.attrib['src']
-                    integrity = el.attrib['integrity']
-                    integrity_hash = integrity.split('-', maxsplit=1)[0]
-                    basename_split = os.path.splitext(os.path.basename(src))
-                    destination = os.path.join(args.static_path, 'immutable', basename_split[0] + '-' + integrity + basename_split[1])
-                    if (
-                            destination not in downloaded_external_scripts and
-                            (not os.path.isfile(destination) or integrity != calculate_sri(destination, integrity_hash))
-                        ):
-                        destination_dirname = os.path.dirname(destination)
-                        if not os.path.isdir(destination_dirname):
-                            os.mkdir(destination_dirname)
-                        download_one_file_to_destination(src, destination)
-                        dl_integrity = calculate_sri(destination, integrity_hash)
-                        if integrity != dl_integrity:
-                            os.unlink(destination)
-                            print('Expected integrity', repr(integrity))
-                            print('Found integrity', repr(dl_integrity))
-                            raise Exception('Downloaded file had wrong integrity (' + destination + ')')
-                    downloaded_external_scripts.add(destination)
-                    el.attrib['src'] = os.path.relpath(destination, os.path.join(args.static_path, os.path.dirname(relpath)))
-                    del el.attrib['integrity']
-                    if 'crossorigin' in el.attrib:
-                        del el.attrib['crossorigin']
-
-                for el in root.xpath('/html/head//link[@rel="canonical" or @rel="amphtml"][@href]'):
-                    if not abs_url_regex.search(el.attrib['href']):
-                        el.attrib['href'] = args.target + re.sub(r'(/|^)index\.html$', r'\1', normpath(PurePosixPath('/').joinpath(relpath.parent, el.attrib['href'])).as_posix())
-                for el in root.xpath('/html/head//meta[@name or @property][@content]'):
-                    if re.search(':url$', el.attrib['name'] if 'name' in el.attrib else el.attrib['property']):
-                        el.attrib['content'] = re.sub(source_url_regex, lambda _: args.target, el.attrib['content'])
-                for el in root.xpath('/html/head/script[@type="application/ld+json"]'):
-                    def urlFixer(o):
-                        for key, value in o.items():
-                            if isinstance(value, str):
-                                o[key] = re.sub(source_url_regex, lambda _: args.target, o[key])
-                            elif isinstance(value, dict):
-                                urlFixer(value)
-
-                    ld = json.loads(el.text)
-                    urlFixer(ld)
-                    el.text = "\n" + json.dumps(ld, sort_keys=True, indent=4) + "\n"
-                for el in root.xpath('//*[@href]'):
-                    if not abs_url_regex.search(el.attrib['href']):
-                        new_href = re.sub(r'(/|^)rss/index\.html$', r'\1rss/index.xml', el.attrib['href'])
-                        new_href = re.sub(r'(/|^)index\.html$', r'\1', new_href)
-                        if el.attrib['href'] != new_href:
-                            el.attrib['href'] = new_href
-                    else:
-                        # Fix social sharing links
-                        el.attrib['href'] = re.sub(re.escape(args.source), lambda _: args.target, el.attrib['href'])
-                        # Fix feedly rss link
-                        el.attrib['href'] = re.sub(re.escape(args.target) + '((?:/[^?&]+)?)/rss/([?&]|$)', lambda m: args.target + m.group(1) + '/rss/index.xml' + m.group(2), el.attrib['href'])
-                return etree.tostring(root, encoding='utf-8', pretty_print=True, method="html", doctype='<!DOCTYPE html>').decode()
-            else:
-                raise Exception("Unknown kind " + kind)
-
-        def fixUrls(relpath, data, kind):
-            if not args.replace:
-                return fixTagsOnly(relpath, data, kind)
-            return fixAllUrls(relpath, data, kind)
-
-        # fix links in all html files
-        for root, dirs, filenames in os.walk(args.static_path):
-            for filename in fnmatch.filter(filenames, 'robots.txt'):
-                filepath = os.path.join(root, filename)
-                with open(filepath) as f:
-                    filetext = f.read()
-                newtext = re.sub(re.escape(args.source), lambda _: args.target, filetext)
-                with open(filepath, 'w') as f:
-                    f.write(newtext)
-            for filename in chain(*(fnmatch.filter(filenames, p) for p in ('*.html', '*.xml'))):
-                filepath = os.path.join(root, filename)
-                relpath = PurePath(os.path.relpath(filepath, args.static_path))
-                kind = os.path.splitext(filename)[1][1:] # 'html' or 'xml'
-                if root.endswith("/rss"):
-                    if kind != 'html':
-                        continue
-                    # rename index.html in .../rss to index.xml
-                    kind = 'xml'
-                    newfilepath = os.path.join(root, os.path.splitext(filename)[0] + ".xml")
-                    os.rename(filepath, newfilepath)
-                    filepath = newfilepath
-                with open(filepath) as f:
-                    filetext = f.read()
-                print("Fixing links in " + filepath)
-                newtext = fixUrls(relpath, filetext, kind)
-                with open(filepath, 'w') as f:
-                    f.write(newtext)
+        from exporter import Exporter
+        exporter = Exporter(
+            args.source,
+            args.target,
+            replace=args.replace,
+            headers=[header[0] for header in args.headers or []],
+            user=args.user[0] if args.user is not None else None,
+            password=args.password[0] if args.password is not None else None,
+            concurrency=args.concurrency,
+            jobs=args.jobs,
+            precompress=args.precompress,
+            script_cache=args.script_cache
+        )
+        stats = exporter.export(args.static_path, args.previous_path, revalidate=args.revalidate, link_dest=args.link_dest, sync=args.sync)
+        if args.stats_file is not None:
+            stats.save(args.stats_file)
 
     elif action == 'preview':
-        os.chdir(args.static_path)
-        server_address = ('', 9000)
-        httpd = HTTPServer(server_address, SimpleHTTPRequestHandler)
+        from preview import PreviewServer
+        server_address = ('', args.port)
+        httpd = PreviewServer(server_address, args.static_path, args.cache_size * 1024 * 1024, args.threads)
 
-        print("Serving at port 9000")
+        print("Serving at port " + str(args.port))
         # gracefully handle interrupt here
-        httpd.serve_forever()
+        try:
+            httpd.serve_forever()
+        finally:
+            httpd.server_close()
 
     elif action == 'setup':
         raise NotImplementedError("TODO update to use python3-compatible library")
@@ -0,0 +1,589 @@
+"""Concurrent in-process replacement for the recursive wget invocation.
+
+The on-disk layout matches what wget produced with the flags buster used
+(--no-host-directories --restrict-file-name=unix --page-requisites
+--no-parent --convert-links): files are saved under their URL path, directory
+URLs become index.html, query strings are kept verbatim in the file name, and
+after the crawl links to downloaded files are rewritten to relative paths
+while links to anything else are made absolute.
+"""
+
+import base64
+import html
+import html.entities
+import http.client
+import os
+import posixpath
+import queue
+import re
+import threading
+import urllib.robotparser
+import output
+from urllib.parse import urljoin, urlsplit, urlunsplit, unquote, quote
+
+# tag -> attributes holding a link we follow and convert
+LINK_ATTRS = {
+    'a': ('href',),
+    'area': ('href',),
+    'link': ('href',),
+    'img': ('src', 'srcset', 'lowsrc'),
+    'script': ('src',),
+    'iframe': ('src',),
+    'frame': ('src',),
+    'embed': ('src',),
+    'source': ('src', 'srcset'),
+    'video': ('src', 'poster'),
+    'audio': ('src',),
+    'track': ('src',),
+    'input': ('src',),
+    'object': ('data',),
+    'body': ('background',),
+    'table': ('background',),
+    'td': ('background',),
+    'th': ('background',),
+}
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 20
+MAX_TRIES = 3
+
+# quotes only delimit attribute values right after the =, and a comment
+# that isn't closed runs to the end of the document, like browsers do
+tag_regex = re.compile(r'''<!--(?:-?>|.*?(?:--!?>|\Z))|<(?P<tag>[a-zA-Z][^\s/>]*)(?P<attrs>(?:[^>=]|=\s*(?:"[^"]*"|'[^']*'|(?=[^\s"'])))*)>''', flags=re.DOTALL)
+attr_regex = re.compile(r'''([^\s"'>/=]+)(?:(\s*=\s*)(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?''')
+charref_regex = re.compile(r'&(?:#[0-9]+;?|#[xX][0-9a-fA-F]+;?|([a-zA-Z][a-zA-Z0-9]*)(;?))')
+# comments and strings are matched only to be skipped
+css_url_regex = re.compile(r'''/\*.*?(?:\*/|\Z)|"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*'|(url\(\s*)(?:"([^"]*)"|'([^']*)'|([^)\s'"]*))(\s*\))|(@import\s*)(?:"([^"]*)"|'([^']*)')''', flags=re.IGNORECASE | re.DOTALL)
+# a candidate's url may contain commas, but doesn't end with one
+srcset_regex = re.compile(r'(\s*)([^\s,](?:\S*[^\s,])?)((?:\s[^,]*)?)')
+ignored_url_regex = re.compile(r'^(?:#|data:|mailto:|javascript:|tel:)', flags=re.IGNORECASE)
+
+
+class CrawlError(Exception):
+    pass
+
+
+def rewrite_css_links(text, fix):
+    """Call fix(url) for every url() and @import in a stylesheet and replace
+    the url with the result unless it is None."""
+    def repl(m):
+        if m.group(1) is not None:
+            for quote_char, group in (('"', 2), ("'", 3), ('', 4)):
+                if m.group(group) is not None:
+                    new_url = fix(m.group(group))
+                    if new_url is None:
+                        return m.group(0)
+                    return m.group(1) + quote_char + new_url + quote_char + m.group(5)
+        if m.group(6) is not None:
+            for quote_char, group in (('"', 7), ("'", 8)):
+                if m.group(group) is not None:
+                    new_url = fix(m.group(group))
+                    if new_url is None:
+                        return m.group(0)
+                    return m.group(6) + quote_char + new_url + quote_char
+        return m.group(0)
+    return css_url_regex.sub(repl, text)
+
+
+def _unescape_attr(value):
+    """html.unescape() an attribute value the way browsers do: a named
+    reference without ; is left alone if a letter, digit or = follows, so
+    the &copy in ?a=1&copy=2 stays."""
+    def repl(m):
+        name, semicolon = m.group(1), m.group(2)
+        if name is None:
+            return html.unescape(m.group(0))
+        if semicolon and name + ';' in html.entities.html5:
+            return html.entities.html5[name + ';']
+        if not semicolon and name in html.entities.html5 and not value.startswith('=', m.end()):
+            return html.entities.html5[name]
+        return m.group(0)
+    return charref_regex.sub(repl, value)
+
+
+def _rewrite_srcset(value, fix):
+    def repl(m):
+        new_url = fix(m.group(2))
+        if new_url is None:
+            return m.group(0)
+        return m.group(1) + new_url + m.group(3)
+    return srcset_regex.sub(repl, value)
+
+
+def rewrite_html_links(text, fix, on_base=None):
+    """Call fix(url) for every link in an HTML document and replace the link
+    with the result unless it is None. Inline stylesheets and style
+    attributes are treated like CSS. on_base is called with the href of a
+    <base> tag when one is found."""
+    out = []
+    pos = 0
+    length = len(text)
+    while pos < length:
+        m = tag_regex.search(text, pos)
+        if m is None:
+            break
+        out.append(text[pos:m.start()])
+        pos = m.end()
+        tag = m.group('tag')
+        if tag is None:  # comment
+            out.append(m.group(0))
+            continue
+        tag = tag.lower()
+        if tag == 'base' and on_base is not None:
+            for am in attr_regex.finditer(m.group('attrs')):
+                if am.group(1).lower() == 'href' and am.group(2) is not None:
+                    on_base(_unescape_attr(am.group(3) or am.group(4) or am.group(5) or ''))
+        out.append('<' + m.group('tag') + _rewrite_attrs(tag, m.group('attrs'), fix) + '>')
+        if tag in ('script', 'style', 'textarea', 'title'):
+            # raw text content; only stylesheets contain links
+            end = re.compile(r'</' + tag + r'\s*>', flags=re.IGNORECASE).search(text, pos)
+            content_end = end.start() if end is not None else length
+            content = text[pos:content_end]
+            if tag == 'style':
+                content = rewrite_css_links(content, fix)
+            out.append(content)
+            pos = content_end
+    out.append(text[pos:])
+    return ''.join(out)
+
+
+def _rewrite_attrs(tag, attrs, fix):
+    names = LINK_ATTRS.get(tag, ())
+
+    def fix_value(name, value):
+        if name in names:
+            if name == 'srcset':
+                return _rewrite_srcset(value, fix)
+            return fix(value)
+        if name == 'style':
+            new_value = rewrite_css_links(value, fix)
+            return new_value if new_value != value else None
+        return None
+
+    def repl(m):
+        if m.group(2) is None:
+            return m.group(0)
+        name = m.group(1).lower()
+        if name not in names and name != 'style':
+            return m.group(0)
+        for quote_char, group in (('"', 3), ("'", 4), ('', 5)):
+            raw = m.group(group)
+            if raw is not None:
+                break
+        value = _unescape_attr(raw)
+        new_value = fix_value(name, value)
+        if new_value is None or new_value == value:
+            return m.group(0)
+        new_value = new_value.replace('&', '&amp;')
+        if quote_char:
+            new_value = new_value.replace(quote_char, '&quot;' if quote_char == '"' else '&#39;')
+        else:
+            quote_char = '"'
+            new_value = new_value.replace('"', '&quot;')
+        return m.group(1) + m.group(2) + quote_char + new_value + quote_char
+    return attr_regex.sub(repl, attrs)
+
+
+def _origin(parts):
+    default_port = 443 if parts.scheme == 'https' else 80
+    return (parts.scheme, (parts.hostname or '').lower(), parts.port or default_port)
+
+
+def canonical_url(url):
+    """Normalize a URL for use as a key: lowercase scheme and host, drop the
+    default port and the fragment."""
+    parts = urlsplit(url)
+    scheme, host, port = _origin(parts)
+    netloc = host if port == (443 if scheme == 'https' else 80) else host + ':' + str(port)
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def _validators(etag, last_modified):
+    if etag is None and last_modified is None:
+        return None
+    return {'etag': etag, 'last_modified': last_modified}
+
+
+def _conditional_headers(entry):
+    if entry is None:
+        return None
+    headers = {}
+    if entry.get('etag') is not None:
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified') is not None:
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers or None
+
+
+def local_path_for_url(url):
+    """Path relative to the output directory that wget would save url as."""
+    parts = urlsplit(url)
+    path = unquote(parts.path)
+    if path == '' or path.endswith('/'):
+        path += 'index.html'
+    path = path.lstrip('/')
+    if parts.query:
+        path += '?' + parts.query
+    return path
+
+
+class Crawler:
+    """Recursively downloads a site with a pool of threads, each keeping its
+    own keep-alive connection to the origin."""
+
+    def __init__(self, source, static_path, concurrency=4, headers=(), user=None, password=None, extra_links=None):
+        self.source = source
+        self.static_path = static_path
+        self.concurrency = max(1, concurrency)
+        self.origin = _origin(urlsplit(source))
+        self.prefix = urlsplit(source).path.rstrip('/') + '/'
+        self.headers = {'Accept-Encoding': 'identity'}
+        for header in headers:
+            name, _, value = header.partition(':')
+            self.headers[name.strip()] = value.strip()
+        self.auth_header = None
+        if user is not None:
+            token = base64.b64encode((user + ':' + (password or '')).encode()).decode()
+            self.auth_header = 'Basic ' + token
+        # canonical url -> local path, including urls that redirected
+        self.downloaded = {}
+        # (local path, final url, kind) of every document we parsed for links
+        self.documents = []
+        # final url -> urls on the site an HTML or CSS document links to
+        self.links = {}
+        # function returning the urls to download along with a document
+        # that it doesn't link to
+        self.extra_links = extra_links
+        self.seen = set()
+        self.saved = set()
+        self.saved_paths = set()
+        self.bytes_saved = 0
+        # urls the origin answered with 304 Not Modified
+        self.unchanged = set()
+        # unchanged urls whose file was kept from the previous export
+        self.kept_previous = set()
+        # url -> {'etag': ..., 'last_modified': ...} from the responses
+        self.validators = {}
+        # url -> journal entry of urls saved by an interrupted export
+        self.resumable = {}
+        # url -> entry with the path, links and validators of the files of
+        # a previous export
+        self.previous = {}
+        self.journal = None
+        # refetched urls that no longer exist on the origin
+        self.gone = set()
+        self.errors = []
+        self.robots = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _connection(self, parts):
+        origin = _origin(parts)
+        connections = getattr(self.local, 'connections', None)
+        if connections is None:
+            connections = self.local.connections = {}
+        conn = connections.get(origin)
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if origin[0] == 'https' else http.client.HTTPConnection
+            conn = connections[origin] = conn_class(origin[1], origin[2], timeout=60)
+        return conn
+
+    def reset_connections(self):
+        """Forget open connections without closing them, e.g. in a forked
+        child whose parent still uses them."""
+        self.local = threading.local()
+
+    def _drop_connection(self, parts):
+        conn = self.local.connections.pop(_origin(parts), None)
+        if conn is not None:
+            conn.close()
+
+    def _request(self, url, extra_headers=None):
+        parts = urlsplit(url)
+        headers = dict(self.headers)
+        if extra_headers:
+            headers.update(extra_headers)
+        if self.auth_header is not None and _origin(parts) == self.origin:
+            headers['Authorization'] = self.auth_header
+        target = urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        for attempt in range(MAX_TRIES):
+            conn = self._connection(parts)
+            try:
+                conn.request('GET', target, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                # stale keep-alive connection or origin hiccup; reconnect
+                self._drop_connection(parts)
+                if attempt == MAX_TRIES - 1:
+                    raise
+                continue
+            if response.will_close:
+                self._drop_connection(parts)
+            return response.status, response.headers, body
+
+    def fetch(self, url, same_origin=True, extra_headers=None):
+        """GET url following redirects. Returns (final url, status, headers,
+        body), or None if a redirect leaves the origin when same_origin is
+        set."""
+        for _ in range(MAX_REDIRECTS):
+            status, headers, body = self._request(url, extra_headers)
+            if status in REDIRECT_STATUSES and 'Location' in headers:
+                url = urljoin(url, headers['Location'])
+                if same_origin and not self._allowed(url):
+                    return None
+                continue
+            return url, status, headers, body
+        raise CrawlError('Too many redirects: ' + url)
+
+    def download_to(self, url, destination):
+        """Download a single url (on any host) to destination."""
+        final_url, status, headers, body = self.fetch(url, same_origin=False)
+        if status != 200:
+            raise CrawlError('Failed to download ' + url + ' (' + str(status) + ')')
+        output.write(destination, body)
+
+    def _allowed(self, url):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or _origin(parts) != self.origin:
+            return False
+        # --no-parent: stay below the source path
+        path = parts.path or '/'
+        if not path.startswith(self.prefix) and path + '/' != self.prefix:
+            return False
+        if self.robots is not None and not self.robots.can_fetch('*', url):
+            return False
+        return True
+
+    def _load_robots(self):
+        if self.robots is not None:
+            return
+        self.robots = urllib.robotparser.RobotFileParser()
+        result = self.fetch(urljoin(self.source + '/', '/robots.txt'))
+        if result is not None and result[1] == 200:
+            self.robots.parse(result[3].decode('utf-8', 'replace').splitlines())
+        else:
+            self.robots.parse([])
+
+    def preload(self, downloaded):
+        """Treat the url -> local path mapping from a previous export as
+        already downloaded: those urls are not followed, but links to them
+        are converted."""
+        self.downloaded.update(downloaded)
+        self.seen.update(downloaded)
+
+    def keep_journal(self, journal):
+        """Record every saved url in journal. The urls already in it are
+        requested conditionally, keeping the saved file if it is unchanged."""
+        self.journal = journal
+        self.resumable = journal.entries
+
+    def revalidate(self, previous):
+        """Request the urls of a previous export conditionally, keeping its
+        file, which is already post-processed, if it is unchanged."""
+        self.previous = previous
+
+    def _entry_to_revalidate(self, url):
+        entry = self.resumable.get(url)
+        if entry is not None and os.path.isfile(os.path.join(self.static_path, entry['path'])):
+            return entry
+        return self.previous.get(url)
+
+    def _enqueue(self, work, url, refetch=False):
+        url = canonical_url(url)
+        with self.lock:
+            if url in (self.saved if refetch else self.seen):
+                return
+            self.seen.add(url)
+        work.put((url, refetch))
+
+    def _save(self, path, body):
+        filepath = os.path.join(self.static_path, path)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        output.write(filepath, body)
+
+    def _process(self, work, url, refetch):
+        entry = self._entry_to_revalidate(url)
+        result = self.fetch(url, extra_headers=_conditional_headers(entry))
+        if result is None:
+            return
+        final_url, status, headers, body = result
+        final_url = canonical_url(final_url)
+        if refetch and status in (404, 410):
+            with self.lock:
+                self.gone.add(url)
+            print('Gone ' + url)
+            return
+        if status == 304 and entry is not None:
+            self._unchanged(work, url, entry)
+            return
+        if status != 200:
+            with self.lock:
+                self.errors.append((url, status))
+            print('Error ' + str(status) + ' fetching ' + url)
+            return
+        # like wget, a redirected url is saved under its original name
+        path = local_path_for_url(url)
+        validators = _validators(headers.get('ETag'), headers.get('Last-Modified'))
+        with self.lock:
+            self.downloaded[url] = path
+            self.saved.add(url)
+            self.saved_paths.add(path)
+            self.bytes_saved += len(body)
+            if validators is not None:
+                self.validators[url] = validators
+        self._save(path, body)
+        print('Downloaded ' + url + ' => ' + path)
+
+        content_type = headers.get_content_type()
+        if content_type == 'text/html':
+            kind = 'html'
+        elif content_type == 'text/css':
+            kind = 'css'
+        else:
+            kind = None
+        links = []
+        if kind is not None:
+            links = [canonical_url(link) for link in self._links(final_url, body, kind) if self._allowed(link)]
+            if self.extra_links is not None:
+                links.extend(canonical_url(link) for link in self.extra_links(url) if self._allowed(link))
+            links = sorted(set(links))
+        if self.journal is not None:
+            self.journal.record(dict(validators or {}, url=url, path=path, final_url=final_url, kind=kind, links=links))
+        if kind is not None:
+            self._add_document(work, url, path, final_url, kind, links)
+
+    def _unchanged(self, work, url, entry):
+        # journaled files are as downloaded, while the files of the previous
+        # export were post-processed already and are left alone
+        journaled = entry is self.resumable.get(url)
+        path = entry['path']
+        validators = _validators(entry.get('etag'), entry.get('last_modified'))
+        with self.lock:
+            self.downloaded[url] = path
+            self.saved.add(url)
+            self.unchanged.add(url)
+            if validators is not None:
+                self.validators[url] = validators
+            if journaled:
+                self.saved_paths.add(path)
+            else:
+                self.kept_previous.add(url)
+        print('Unchanged ' + url + ' => ' + path)
+        if journaled and entry['kind'] is not None:
+            self._add_document(work, url, path, entry['final_url'], entry['kind'], entry['links'])
+        elif not journaled and entry['links'] is not None:
+            with self.lock:
+                self.links[url] = entry['links']
+            for link in entry['links']:
+                self._enqueue(work, link)
+
+    def _add_document(self, work, url, path, final_url, kind, links):
+        with self.lock:
+            self.documents.append((path, final_url, kind))
+            self.links[url] = links
+        for link in links:
+            self._enqueue(work, link)
+
+    def _links(self, base_url, body, kind):
+        links = []
+        base = [base_url]
+        text = body.decode('utf-8', 'surrogateescape')
+
+        def collect(link):
+            link = link.strip()
+            if link and not ignored_url_regex.match(link):
+                links.append(urljoin(base[0], link))
+            return None
+
+        def on_base(href):
+            base[0] = urljoin(base_url, href)
+        if kind == 'css':
+            rewrite_css_links(text, collect)
+        else:
+            rewrite_html_links(text, collect, on_base)
+        return links
+
+    def _worker(self, work):
+        while True:
+            item = work.get()
+            if item is None:
+                work.task_done()
+                return
+            url, refetch = item
+            try:
+                self._process(work, url, refetch)
+            except Exception as e:
+                with self.lock:
+                    self.errors.append((url, e))
+                print('Error fetching ' + url + ': ' + repr(e))
+            finally:
+                work.task_done()
+
+    def crawl(self, relpaths, refetch=False):
+        """Download every relpath under the source and everything reachable
+        from them. Raises CrawlError if any fetch failed."""
+        self.crawl_urls([self.source + relpath for relpath in relpaths], refetch)
+
+    def crawl_urls(self, urls, refetch=False):
+        """Like crawl() but with absolute urls. With refetch, urls are
+        downloaded again even if they were preloaded, and urls that are now
+        missing on the origin are added to self.gone instead of failing the
+        crawl."""
+        if len(urls) == 0:
+            return
+        self._load_robots()
+        work = queue.Queue()
+        for url in dict.fromkeys(canonical_url(url) for url in urls):
+            self._enqueue(work, url, refetch)
+        threads = [threading.Thread(target=self._worker, args=(work,), daemon=True) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        work.join()
+        for _ in threads:
+            work.put(None)
+        for thread in threads:
+            thread.join()
+        if self.errors:
+            errors, self.errors = self.errors, []
+            raise CrawlError('Failed to fetch: ' + ', '.join(url + ' (' + str(reason) + ')' for url, reason in errors))
+
+    def _convert_link(self, doc_path, base_url, link):
+        stripped = link.strip()
+        if ignored_url_regex.match(stripped) or stripped == '':
+            return None
+        absolute = urljoin(base_url, stripped)
+        parts = urlsplit(absolute)
+        if parts.scheme not in ('http', 'https'):
+            return None
+        target = self.downloaded.get(canonical_url(absolute))
+        if target is None:
+            # not downloaded: point at the original location
+            return absolute
+        target_path, question, query = target.partition('?')
+        relative = posixpath.relpath(target_path, posixpath.dirname(doc_path) or '.')
+        relative = quote(relative, safe="/=&;:@+$,!~*'()") + question + query
+        if parts.fragment:
+            relative += '#' + parts.fragment
+        return relative
+
+    def convert_links(self):
+        """Rewrite links in every downloaded HTML and CSS document, like
+        wget --convert-links."""
+        for path, url, kind in self.documents:
+            filepath = os.path.join(self.static_path, path)
+            with open(filepath, 'rb') as f:
+                text = f.read().decode('utf-8', 'surrogateescape')
+            base = [url]
+
+            def fix(link):
+                return self._convert_link(path, base[0], link)
+
+            def on_base(href):
+                base[0] = urljoin(url, href)
+            if kind == 'css':
+                newtext = rewrite_css_links(text, fix)
+            else:
+                newtext = rewrite_html_links(text, fix, on_base)
+            if newtext != text:
+                output.write(filepath, newtext.encode('utf-8', 'surrogateescape'))
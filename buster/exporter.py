@@ -0,0 +1,419 @@
+"""The generate pipeline as a reusable object.
+
+An Exporter holds the configuration of a site's exports and everything that
+doesn't depend on one particular export: the compiled patterns, the memoized
+url rewriting and the script cache. A long-running process such as
+autobuster keeps one instance and calls export() for every export, instead
+of starting a new interpreter each time.
+
+While export() runs, the state of that export (its directory, crawler,
+stats...) is kept on the instance, so an Exporter makes one export at a
+time. Exports made at the same time need an Exporter each.
+"""
+
+import json
+import os
+from pathlib import PurePath, PurePosixPath
+import posixpath
+import re
+from lxml import etree
+from normpath import normpath
+from crawler import Crawler, canonical_url
+from fileindex import FileIndex
+from urlrewriter import UrlRewriter, QueryStripper
+import incremental
+import journal
+import linkdest
+import output
+import parallel
+import precompress
+from scriptcache import ScriptCache, calculate_sri, integrity_filename, verify
+from stats import Stats
+import xmlstream
+
+START_PATHS = ('', '/robots.txt', '/sitemap.xml', *incremental.SITEMAP_PATHS)
+
+# remove superfluous "index.html" from relative hyperlinks found in text
+abs_url_regex = re.compile(r'^(?:[a-z]+:)?//', flags=re.IGNORECASE)
+
+
+class Exporter:
+    def __init__(self, source, target, replace=False, headers=(), user=None, password=None,
+                 concurrency=4, jobs=1, precompress=False, script_cache=None):
+        """source and target are the urls of the Ghost site and of the
+        exported one. With replace, every occurrence of source is replaced,
+        not just those in links. script_cache is the directory in which to
+        keep the integrity-pinned external scripts across exports."""
+        self.source = source
+        self.target = target
+        self.replace = replace
+        self.headers = list(headers)
+        self.user = user
+        self.password = password
+        self.concurrency = concurrency
+        self.jobs = jobs
+        self.precompress = precompress
+        self.manifest_options = {'source': source, 'target': target, 'replace': replace}
+
+        self.collection_regex = re.compile('^' + re.escape(canonical_url(source + '/')) + r'(?:tag|author)/[^/]+/')
+        self.rewriter = UrlRewriter(source, target)
+        # Verified external files, kept across exports
+        self.script_cache = ScriptCache(script_cache) if script_cache is not None else None
+
+    def collection_feeds(self, url):
+        # tag and author pages link to the site's feed, not their own
+        m = self.collection_regex.match(url)
+        return [m.group() + 'rss/'] if m else []
+
+    def export(self, static_path, previous_path=None, revalidate=False, link_dest=None, sync=False):
+        """Export the site into static_path. With previous_path, start from
+        the export in that directory and only download what changed since,
+        or with revalidate, what the source doesn't say is unchanged. Files
+        identical to the ones in link_dest are hardlinked to them. With sync,
+        the export is flushed to disk before returning. Returns the Stats of
+        the export. Must not be called again before it returns."""
+        if revalidate and previous_path is None:
+            raise Exception('Revalidating needs a previous export')
+        self.start(static_path)
+        stats = self.stats
+        self.crawler = crawler = Crawler(
+            self.source,
+            static_path,
+            concurrency=self.concurrency,
+            headers=self.headers,
+            user=self.user,
+            password=self.password,
+            extra_links=self.collection_feeds
+        )
+
+        manifest = None
+        if previous_path is not None:
+            manifest = incremental.load_manifest(previous_path, self.manifest_options)
+            if manifest is None:
+                print("No usable manifest for " + previous_path + ", doing a full export")
+
+        # lets a failed export be resumed by running it again
+        crawl_journal = journal.Journal(static_path, dict(
+            self.manifest_options,
+            previous=previous_path if manifest is not None else None,
+            revalidate=revalidate
+        ))
+        if crawl_journal.entries:
+            print("Resuming the export in " + static_path + ", revalidating " + str(len(crawl_journal.entries)) + " downloaded urls")
+        crawler.keep_journal(crawl_journal)
+        try:
+            if manifest is not None:
+                # an export being resumed copied it already
+                if not crawl_journal.entries:
+                    with stats.stage('copy-previous'):
+                        incremental.copy_previous(previous_path, static_path)
+                crawler.revalidate(incremental.previous_files(manifest))
+                with stats.stage('crawl'):
+                    if revalidate:
+                        crawler.crawl(START_PATHS)
+                        lastmods = incremental.read_lastmods(static_path, crawler, manifest)
+                    else:
+                        crawler.preload(manifest['paths'])
+                        crawler.crawl(START_PATHS[1:], refetch=True)
+                        lastmods = incremental.read_lastmods(static_path, crawler, manifest)
+                        incremental.refetch_changed(crawler, manifest, lastmods)
+            else:
+                with stats.stage('crawl'):
+                    crawler.crawl(START_PATHS)
+                    lastmods = incremental.read_lastmods(static_path, crawler)
+        except:
+            # kept for resuming
+            crawl_journal.close()
+            raise
+        crawl_journal.remove()
+        stats.count('crawl', files=len(crawler.saved_paths), bytes=crawler.bytes_saved)
+        stats.count('crawl/unchanged', files=len(crawler.unchanged))
+        if crawler.unchanged:
+            print("Kept " + str(len(crawler.unchanged)) + " unchanged files")
+
+        links = manifest['links'] if manifest is not None else {}
+        links.update(crawler.links)
+        if manifest is not None:
+            with stats.stage('prune'):
+                if revalidate:
+                    incremental.remove_uncrawled(crawler, manifest, links)
+                incremental.prune_unreachable(crawler, links, [self.source + x for x in START_PATHS])
+        # make links relative, like wget --convert-links
+        with stats.stage('convert-links', files=len(crawler.documents)):
+            crawler.convert_links()
+
+        # the files written by this export; the ones carried over from the
+        # previous export are already processed
+        downloaded_paths = set(crawler.downloaded.values())
+        index = FileIndex(path for path in crawler.saved_paths if path in downloaded_paths)
+
+        with stats.stage('rename'):
+            files = self.rename(index)
+        stats.count('rename', files=len(files))
+        if manifest is not None:
+            files.extend(manifest['renamed'])
+
+        self.start_fix(files)
+
+        # fix links in all html files
+        with stats.stage('scan'):
+            files_to_fix = self.scan(index)
+
+        with stats.stage('fix'):
+            if self.jobs > 1 and len(files_to_fix) > 1:
+                for file_stats in parallel.starmap(self.fix_file_in_worker, files_to_fix, self.jobs, self.init_fix_worker):
+                    stats.merge(file_stats)
+            else:
+                for item in files_to_fix:
+                    self.timed_fix_file(*item)
+
+        # the siblings of files that didn't change are carried over with them
+        previous_compressed = manifest.get('compressed', {}) if manifest is not None else {}
+        compressed = {}
+        with stats.stage('precompress'):
+            if self.precompress:
+                reference = incremental.read_manifest(link_dest) if link_dest is not None else None
+                compressed = precompress.compress_all(
+                    static_path,
+                    self.jobs,
+                    previous_compressed,
+                    link_dest,
+                    reference.get('compressed') if reference is not None else None
+                )
+            precompress.remove_stale(static_path, previous_compressed, compressed)
+        stats.count('precompress', files=len(compressed))
+
+        # the validators of the files carried over without a request
+        validators = manifest.get('validators', {}) if manifest is not None else {}
+        validators.update(crawler.validators)
+        validators = {url: value for url, value in validators.items() if url in crawler.downloaded}
+        with stats.stage('manifest'):
+            incremental.save_manifest(static_path, {
+                'version': incremental.MANIFEST_VERSION,
+                'options': self.manifest_options,
+                'lastmod': lastmods,
+                'paths': crawler.downloaded,
+                'links': links,
+                'renamed': sorted(set(files)),
+                'compressed': compressed,
+                'validators': validators
+            })
+
+        if link_dest is not None:
+            with stats.stage('link-dest'):
+                linked, saved = linkdest.link_identical(static_path, link_dest)
+            stats.count('link-dest', files=linked, bytes=saved)
+            print("Linked " + str(linked) + " files (" + str(saved) + " bytes) to " + link_dest)
+
+        if sync:
+            with stats.stage('sync'):
+                output.sync(static_path)
+
+        stats.print_summary()
+        return stats
+
+    def start(self, static_path):
+        """Set up the state of an export into static_path."""
+        self.static_path = static_path
+        self.stats = Stats()
+        # made here because lxml parsers shouldn't move between threads, and
+        # autobuster makes every export in a new one
+        self.html_parser = etree.HTMLParser(encoding='utf-8')
+
+    def start_fix(self, files):
+        """Set up the state of the fix methods. files are the names of the
+        renamed files, whose query strings are removed from links."""
+        # look up query strings to remove by the file-list (i.e. all files, with stripped arguments from above)
+        self.query_stripper = QueryStripper(files)
+
+        # The URLs of all external files we've internalized
+        self.downloaded_external_scripts = set()
+        # Held while checking or downloading an external file, so parallel
+        # jobs never see each other's partial downloads
+        self.external_scripts_lock = parallel.context().Lock()
+
+    def rename(self, index):
+        """Remove the ghost-sdk scripts and the query strings from file
+        names. Returns the new names of the renamed files."""
+        for path in index.match('public/ghost-sdk*.js*'):
+            os.remove(os.path.join(self.static_path, path))
+            index.remove(path)
+
+        # init list of renamed files
+        files = []
+        # remove query string since Ghost 0.4
+        for path in index.by_name('*[?]*'):
+            dirname, filename = posixpath.split(path)
+            newname = re.sub(r'\?.*', '', filename)
+            print("Rename " + filename + " => " + newname)
+            os.rename(os.path.join(self.static_path, path), os.path.join(self.static_path, dirname, newname))
+            index.rename(path, posixpath.join(dirname, newname))
+            files.append(newname) # add new name to file-list
+        return files
+
+    def scan(self, index):
+        """Fix robots.txt and rename feeds to .xml. Returns the (filepath,
+        relpath, kind) of every file to fix."""
+        files_to_fix = []
+        for path in index.by_name('robots.txt'):
+            filepath = os.path.join(self.static_path, path)
+            with open(filepath) as f:
+                filetext = f.read()
+            output.write(filepath, self.rewriter.text(filetext), previous=filetext)
+        for path in index.by_name('*.html', '*.xml'):
+            dirname, filename = posixpath.split(path)
+            filepath = os.path.join(self.static_path, path)
+            kind = os.path.splitext(filename)[1][1:] # 'html' or 'xml'
+            if posixpath.basename(dirname) == 'rss':
+                if kind != 'html':
+                    continue
+                # rename index.html in .../rss to index.xml
+                kind = 'xml'
+                newpath = posixpath.join(dirname, os.path.splitext(filename)[0] + ".xml")
+                newfilepath = os.path.join(self.static_path, newpath)
+                os.rename(filepath, newfilepath)
+                index.rename(path, newpath)
+                path = newpath
+                filepath = newfilepath
+            files_to_fix.append((filepath, PurePath(path), kind))
+        return files_to_fix
+
+    def report_removed(self, filename, query):
+        print("---Removing " + query + " from " + filename)
+
+    def replace_all_urls(self, data):
+        # substitute all occurences of the source url with the target url
+        with self.stats.stage('fix/replace-all'):
+            data = self.rewriter.text(data)
+
+            # remove URL arguments (e.g. query string) from renamed files
+            # TODO: make it work with googlefonts
+            data = self.query_stripper.sub(data, self.report_removed)
+        return data
+
+    def fixAllUrls(self, relpath, data, kind):
+        print("Fixing HTML")
+        # fixTagsOnly parses and serializes the page once with lxml;
+        # encoding='utf-8' keeps non-ascii characters as they are
+        # instead of turning them into numeric character references,
+        # so the rest is plain text substitution.
+        data = self.fixTagsOnly(relpath, data, kind)
+        return self.replace_all_urls(data)
+
+    def fix_xml_element(self, el):
+        name = etree.QName(el)
+        if el.tag in ('link', 'url') or name.localname == 'loc':
+            el.text = self.rewriter.xml_url(el.text)
+        if 'href' in el.attrib:
+            el.attrib['href'] = self.rewriter.absolute(el.attrib['href'])
+            if (
+                    name.localname == 'link' and name.namespace == 'http://www.w3.org/2005/Atom' and
+                    el.attrib.get('rel') == 'self' and el.attrib.get('type') == 'application/rss+xml'
+                ):
+                el.attrib['href'] = re.sub(r'/rss/$', '/rss/index.xml', el.attrib['href'])
+
+    def fixTagsOnly(self, relpath, data, kind):
+        print("Fixing tags")
+        if kind != 'html':
+            raise Exception("Unknown kind " + kind)
+        stats = self.stats
+        rewriter = self.rewriter
+        with stats.stage('fix/parse'):
+            root = etree.fromstring(data.encode(), self.html_parser)
+
+        # Remove ghost API javascript. Static files don't need this.
+        for el in root.xpath('//script[@type="text/javascript"][contains(@src,"public/ghost-sdk.")][contains(@src,".js")]'):
+            el.getparent().remove(el)
+        for el in root.xpath('//script[@type="text/javascript"][not(@src)]'):
+            if re.match(r'\s*ghost\.init\(', el.text):
+                el.getparent().remove(el)
+
+        # Copy any remote static (has integrity attr) javascript files to be local
+        with stats.stage('fix/external-scripts'):
+            for el in root.xpath('//script[@integrity][starts-with(@src,"https:")]'):
+                src = el.attrib['src']
+                integrity = el.attrib['integrity']
+                integrity_hash = integrity.split('-', maxsplit=1)[0]
+                basename_split = os.path.splitext(os.path.basename(src))
+                destination = os.path.join(self.static_path, 'immutable', basename_split[0] + '-' + integrity_filename(integrity) + basename_split[1])
+                with self.external_scripts_lock:
+                    if destination not in self.downloaded_external_scripts:
+                        destination_dirname = os.path.dirname(destination)
+                        if not os.path.isdir(destination_dirname):
+                            os.mkdir(destination_dirname)
+                        if self.script_cache is not None:
+                            self.script_cache.install(integrity, lambda path: self.crawler.download_to(src, path), destination)
+                        elif not os.path.isfile(destination) or integrity != calculate_sri(destination, integrity_hash):
+                            self.crawler.download_to(src, destination)
+                            verify(destination, integrity)
+                    self.downloaded_external_scripts.add(destination)
+                el.attrib['src'] = os.path.relpath(destination, os.path.join(self.static_path, os.path.dirname(relpath)))
+                del el.attrib['integrity']
+                if 'crossorigin' in el.attrib:
+                    del el.attrib['crossorigin']
+
+        with stats.stage('fix/rewrite'):
+            for el in root.xpath('/html/head//link[@rel="canonical" or @rel="amphtml"][@href]'):
+                if not abs_url_regex.search(el.attrib['href']):
+                    el.attrib['href'] = self.target + re.sub(r'(/|^)index\.html$', r'\1', normpath(PurePosixPath('/').joinpath(relpath.parent, el.attrib['href'])).as_posix())
+            for el in root.xpath('/html/head//meta[@name or @property][@content]'):
+                if re.search(':url$', el.attrib['name'] if 'name' in el.attrib else el.attrib['property']):
+                    el.attrib['content'] = rewriter.absolute(el.attrib['content'])
+            for el in root.xpath('/html/head/script[@type="application/ld+json"]'):
+                def urlFixer(o):
+                    for key, value in o.items():
+                        if isinstance(value, str):
+                            o[key] = rewriter.absolute(value)
+                        elif isinstance(value, dict):
+                            urlFixer(value)
+
+                ld = json.loads(el.text)
+                urlFixer(ld)
+                el.text = "\n" + json.dumps(ld, sort_keys=True, indent=4) + "\n"
+            for el in root.xpath('//*[@href]'):
+                href = el.attrib['href']
+                # relative links lose index.html, absolute ones (social
+                # sharing, feedly) get the target url
+                new_href = rewriter.href(href, bool(abs_url_regex.search(href)))
+                if href != new_href:
+                    el.attrib['href'] = new_href
+        with stats.stage('fix/serialize'):
+            return etree.tostring(root, encoding='utf-8', pretty_print=True, method="html", doctype='<!DOCTYPE html>').decode()
+
+    def fixUrls(self, relpath, data, kind):
+        if not self.replace:
+            return self.fixTagsOnly(relpath, data, kind)
+        return self.fixAllUrls(relpath, data, kind)
+
+    def fix_file(self, filepath, relpath, kind):
+        if kind == 'xml':
+            # sitemaps and feeds can be large, so they are streamed
+            print("Fixing links in " + filepath)
+            if self.replace:
+                print("Fixing XML")
+                xmlstream.rewrite_in_place(filepath, fix_text=self.replace_all_urls)
+            else:
+                print("Fixing tags")
+                xmlstream.rewrite_in_place(filepath, fix_element=self.fix_xml_element)
+            return
+        with open(filepath) as f:
+            filetext = f.read()
+        print("Fixing links in " + filepath)
+        newtext = self.fixUrls(relpath, filetext, kind)
+        with self.stats.stage('fix/write'):
+            if not output.write(filepath, newtext, previous=filetext):
+                self.stats.count('fix/unchanged', files=1)
+
+    def timed_fix_file(self, filepath, relpath, kind):
+        with self.stats.file('fix/' + kind, str(relpath), bytes=os.path.getsize(filepath)):
+            self.fix_file(filepath, relpath, kind)
+
+    def fix_file_in_worker(self, filepath, relpath, kind):
+        # send this file's stats back to the parent's
+        self.stats.reset()
+        self.timed_fix_file(filepath, relpath, kind)
+        return self.stats.to_dict()
+
+    def init_fix_worker(self):
+        # don't share the parent's sockets with forked workers
+        self.crawler.reset_connections()
@@ -0,0 +1,40 @@
+"""In-memory index of the files of an export.
+
+The crawler knows the path of every file it saved, so the stages after it
+look files up here instead of walking the output directory again. Paths are
+relative to the output directory and use forward slashes.
+"""
+
+import fnmatch
+import posixpath
+
+
+class FileIndex:
+    def __init__(self, paths=()):
+        self.paths = set(paths)
+
+    def __iter__(self):
+        return iter(sorted(self.paths))
+
+    def __contains__(self, path):
+        return path in self.paths
+
+    def add(self, path):
+        self.paths.add(path)
+
+    def remove(self, path):
+        self.paths.discard(path)
+
+    def rename(self, path, new_path):
+        self.paths.discard(path)
+        self.paths.add(new_path)
+
+    def match(self, pattern):
+        """The paths matching a glob pattern like dir/name*.ext, with
+        wildcards in the file name only."""
+        directory, name = posixpath.split(pattern)
+        return sorted(path for path in self.paths if posixpath.dirname(path) == directory and fnmatch.fnmatch(posixpath.basename(path), name))
+
+    def by_name(self, *patterns):
+        """The paths whose file name matches one of the glob patterns."""
+        return sorted(path for path in self.paths if any(fnmatch.fnmatch(posixpath.basename(path), p) for p in patterns))
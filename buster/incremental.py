@@ -0,0 +1,274 @@
+"""Incremental exports.
+
+Every export leaves a manifest next to the output directory with the lastmod
+of every url in Ghost's sitemaps, where each url was saved and which pages link
+to which. An incremental export starts from a copy of the previous output and
+only downloads the urls whose lastmod changed plus the pages listing them
+(home, tag and author pages with their pagination and RSS feeds).
+
+Changes that don't touch a post, page, tag or author (navigation, theme or
+other settings) don't show up in the sitemaps, so a full export is still
+needed for those. A revalidating export crawls the whole site like a full
+one, but starting from the previous output too.
+
+The manifest also keeps the ETag and Last-Modified the origin sent for each
+url. Incremental and revalidating exports request the urls of the previous
+export conditionally, and keep its file (already post-processed) when the
+origin answers 304 Not Modified.
+"""
+
+import json
+import os
+import re
+from lxml import etree
+from crawler import canonical_url
+import output
+
+# The manifest of static/ is static.buster-manifest.json. It isn't part of
+# the site, and would tell anyone the source's address and more if it were
+# published with it.
+MANIFEST_SUFFIX = '.buster-manifest.json'
+# 2: the links of tag and author pages include their RSS feed
+MANIFEST_VERSION = 2
+
+SITEMAP_PATHS = (
+    '/sitemap-pages.xml',
+    '/sitemap-posts.xml',
+    '/sitemap-authors.xml',
+    '/sitemap-tags.xml'
+)
+
+pagination_regex = re.compile(r'^(.*/)page/\d+/$')
+
+
+def manifest_path(static_path):
+    """The file keeping the manifest of the export in static_path. Symlinks
+    to the export (like autobuster's current) lead to its own manifest."""
+    return os.path.realpath(static_path) + MANIFEST_SUFFIX
+
+
+def read_manifest(static_path):
+    """Returns the manifest of the export in static_path, or None."""
+    try:
+        with open(manifest_path(static_path)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def load_manifest(static_path, options):
+    """Returns the manifest of the export in static_path, or None if there
+    is none or it was made with different options."""
+    manifest = read_manifest(static_path)
+    if manifest is None or manifest.get('options') != options:
+        return None
+    return manifest
+
+
+def save_manifest(static_path, manifest):
+    output.write(manifest_path(static_path), json.dumps(manifest, sort_keys=True))
+    # older versions kept it in the export itself
+    old_path = os.path.join(static_path, MANIFEST_SUFFIX)
+    if os.path.isfile(old_path):
+        os.remove(old_path)
+
+
+def copy_previous(previous_path, static_path):
+    """Carry the files of the previous export over into static_path, as
+    hardlinks when possible."""
+    if os.path.isdir(static_path) and os.path.samefile(previous_path, static_path):
+        return
+    # Hardlinked, since nothing writes into an existing file: a file is
+    # always replaced, so the previous export is never changed through the
+    # link. static_path may exist already, so not shutil.copytree().
+    for dirpath, dirnames, filenames in os.walk(previous_path):
+        target_dir = os.path.join(static_path, os.path.relpath(dirpath, previous_path))
+        os.makedirs(target_dir, exist_ok=True)
+        for name in dirnames + filenames:
+            source = os.path.join(dirpath, name)
+            target = os.path.join(target_dir, name)
+            if os.path.islink(source):
+                if os.path.lexists(target):
+                    os.remove(target)
+                os.symlink(os.readlink(source), target)
+            elif name in filenames:
+                output.link(source, target)
+
+
+def previous_files(manifest):
+    """The url -> entry of the previous export's files to revalidate, for
+    Crawler.revalidate()."""
+    paths = manifest['paths']
+    links = manifest['links']
+    return {
+        url: dict(validators, path=paths[url], links=links.get(url))
+        for url, validators in manifest.get('validators', {}).items() if url in paths
+    }
+
+
+def read_lastmods(static_path, crawler, manifest=None):
+    """Returns {sitemap relpath: {url: lastmod}} from the downloaded sitemaps."""
+    lastmods = {}
+    for relpath in SITEMAP_PATHS:
+        url = canonical_url(crawler.source + relpath)
+        if url in crawler.kept_previous:
+            # the kept file has its urls rewritten already, but it is the
+            # one the manifest's lastmods were read from
+            lastmods[relpath] = dict(manifest['lastmod'].get(relpath, {}))
+            continue
+        urls = lastmods[relpath] = {}
+        path = crawler.downloaded.get(url)
+        if path is None:
+            continue
+        root = etree.parse(os.path.join(static_path, path)).getroot()
+        for el in root.xpath('//*[local-name()="url"]'):
+            loc = el.xpath('string(*[local-name()="loc"])').strip()
+            if loc:
+                urls[canonical_url(loc)] = el.xpath('string(*[local-name()="lastmod"])').strip()
+    return lastmods
+
+
+def _collections(source, links):
+    """The listing pages (home, tags, authors) a page links to."""
+    home = canonical_url(source + '/')
+    prefix = canonical_url(source + '/').rstrip('/')
+    collection_regex = re.compile('^' + re.escape(prefix) + r'/(?:tag|author)/[^/]+/$')
+    return {link for link in links if link == home or collection_regex.match(link)}
+
+
+def _output_paths(path):
+    """The names a downloaded file can have after post-processing."""
+    return {
+        path,
+        re.sub(r'(/|^)rss/index\.html$', r'\1rss/index.xml', path),
+        re.sub(r'\?[^/]*$', '', path)
+    }
+
+
+def _remove_page(static_path, path, keep=()):
+    for candidate in _output_paths(path) - set(keep):
+        filepath = os.path.join(static_path, candidate)
+        if os.path.isfile(filepath):
+            print("Remove " + filepath)
+            os.remove(filepath)
+            try:
+                os.removedirs(os.path.dirname(filepath))
+            except OSError:
+                pass
+
+
+def refetch_changed(crawler, manifest, lastmods):
+    """Download the urls whose lastmod differs from the manifest and every
+    page that lists them, and delete the pages that are gone. Updates the
+    manifest's links and returns the urls that were removed."""
+    old_links = manifest['links']
+    referrers = {}
+    for page, links in old_links.items():
+        for link in links:
+            referrers.setdefault(link, set()).add(page)
+
+    changed = {}
+    removed = set()
+    for relpath in SITEMAP_PATHS:
+        old = manifest['lastmod'].get(relpath, {})
+        new = lastmods[relpath]
+        changed[relpath] = {url for url, lastmod in new.items() if old.get(url) != lastmod}
+        removed |= {url for url in old if url not in new}
+        for url in sorted(changed[relpath]):
+            print("Changed " + url)
+    for url in sorted(removed):
+        print("Removed " + url)
+
+    # the changed pages themselves first, so we know what they link to now
+    crawler.crawl_urls(sorted(set().union(*changed.values())), refetch=True)
+    removed |= crawler.gone
+
+    refetch = set()
+    collections = set()
+    for url in removed:
+        refetch |= referrers.get(url, set())
+        collections |= _collections(crawler.source, old_links.get(url, ()))
+    for url in changed['/sitemap-posts.xml'] | changed['/sitemap-pages.xml']:
+        refetch |= referrers.get(url, set())
+        old_collections = _collections(crawler.source, old_links.get(url, ()))
+        new_collections = _collections(crawler.source, crawler.links.get(url, ()))
+        if url in old_links:
+            # moving a post between tags or authors changes their pagination
+            collections |= old_collections ^ new_collections
+        else:
+            # a new post shifts every page of the lists it appears in
+            collections |= new_collections
+    for relpath in ('/sitemap-authors.xml', '/sitemap-tags.xml'):
+        collections |= changed[relpath]
+
+    known = manifest['paths']
+
+    def collection_pages(collection):
+        page_regex = re.compile('^' + re.escape(collection) + r'(?:page/\d+/|rss/)$')
+        return {url for url in known if page_regex.match(url)}
+
+    # a deleted tag or author takes its pagination and feed with it
+    for url in list(removed):
+        if url in manifest['lastmod']['/sitemap-authors.xml'] or url in manifest['lastmod']['/sitemap-tags.xml']:
+            removed |= collection_pages(url)
+    collections -= removed
+
+    for collection in collections:
+        refetch.add(collection)
+        refetch |= collection_pages(collection)
+    feeds = set()
+    for url in refetch:
+        m = pagination_regex.match(url)
+        root = m.group(1) if m else url
+        if root + 'rss/' in known:
+            feeds.add(root + 'rss/')
+    refetch |= feeds
+    refetch -= crawler.saved
+    refetch -= removed
+
+    crawler.crawl_urls(sorted(refetch), refetch=True)
+    removed |= crawler.gone
+
+    for url in sorted(removed):
+        path = crawler.downloaded.pop(url, None)
+        if path is not None and path not in crawler.saved_paths:
+            _remove_page(crawler.static_path, path)
+        old_links.pop(url, None)
+    return removed
+
+
+def remove_uncrawled(crawler, manifest, links):
+    """Delete the files of the previous export whose urls a revalidating
+    crawl didn't reach."""
+    keep = set().union(*(_output_paths(path) for path in crawler.downloaded.values()))
+    for url, path in manifest['paths'].items():
+        if url not in crawler.downloaded:
+            links.pop(url, None)
+            _remove_page(crawler.static_path, path, keep)
+
+
+def prune_unreachable(crawler, links, roots):
+    """Delete carried over files that nothing links to any more, such as the
+    images of a deleted post, so the result matches a full export."""
+    downloaded = crawler.downloaded
+    path_links = {}
+    for url, targets in links.items():
+        if url in downloaded:
+            path_links.setdefault(downloaded[url], set()).update(downloaded[t] for t in targets if t in downloaded)
+    reachable = set()
+    stack = [downloaded[canonical_url(root)] for root in roots if canonical_url(root) in downloaded]
+    while stack:
+        path = stack.pop()
+        if path in reachable:
+            continue
+        reachable.add(path)
+        stack.extend(path_links.get(path, ()))
+    keep = set().union(*(_output_paths(path) for path in reachable))
+    for url, path in list(downloaded.items()):
+        if path not in reachable:
+            del downloaded[url]
+            links.pop(url, None)
+            _remove_page(crawler.static_path, path, keep)
@@ -0,0 +1,74 @@
+"""Journal of the urls an export has downloaded.
+
+While crawling, an export appends a line to the journal for every url it
+saves: where it was saved, its validators (ETag and Last-Modified) and the
+links found in it. If the export fails partway, usually because the origin
+went away, running it again with the same options into the same directory
+resumes the crawl: the journaled urls are requested again conditionally,
+and those the origin reports as unchanged keep the file already on disk
+instead of being downloaded again.
+
+The journal is removed as soon as the crawl is complete, because the stages
+after it change the downloaded files in place.
+"""
+
+import json
+import os
+import threading
+import output
+
+JOURNAL_FILENAME = '.buster-journal'
+JOURNAL_VERSION = 1
+
+
+def _read(filename, options):
+    """Returns {url: entry} from a journal made with options, or None."""
+    entries = {}
+    try:
+        with open(filename) as f:
+            lines = f.read().split('\n')
+    except FileNotFoundError:
+        return None
+    try:
+        header = json.loads(lines[0])
+    except ValueError:
+        return None
+    if header.get('version') != JOURNAL_VERSION or header.get('options') != options:
+        return None
+    for line in lines[1:]:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            # the last line is cut short if the export was killed
+            continue
+        entries[entry['url']] = entry
+    return entries
+
+
+class Journal:
+    def __init__(self, static_path, options):
+        """Open the journal in static_path, keeping the entries of an
+        interrupted export with the same options in self.entries."""
+        self.filename = os.path.join(static_path, JOURNAL_FILENAME)
+        entries = _read(self.filename, options)
+        self.entries = entries or {}
+        os.makedirs(static_path, exist_ok=True)
+        # written from scratch so a line cut short doesn't get appended to
+        lines = [{'version': JOURNAL_VERSION, 'options': options}] + list(self.entries.values())
+        output.write(self.filename, ''.join(json.dumps(line) + '\n' for line in lines))
+        self.file = open(self.filename, 'a')
+        self.lock = threading.Lock()
+
+    def record(self, entry):
+        line = json.dumps(entry) + '\n'
+        with self.lock:
+            self.file.write(line)
+            # flushed so the line survives the process being killed
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.filename)
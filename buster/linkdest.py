@@ -0,0 +1,105 @@
+"""Hardlink the files of an export to identical ones of a previous export.
+
+Most of a site (images, theme assets, old posts) doesn't change between two
+exports, so linking the new export's files to the previous one's keeps only
+one copy of them on disk, like rsync --link-dest. Files are matched by
+content: a file is compared with the file at the same path in the reference
+first, then with any other reference file of the same size, by sha256. Files
+that are the reference's file already, or have the size and modification
+time of the file at the same path, aren't read at all.
+"""
+
+import hashlib
+import os
+import stat
+import output
+
+HASH_BLOCK_SIZE = 128 * 1024
+
+
+def file_hash(filepath):
+    h = hashlib.sha256()
+    with open(filepath, 'rb', buffering=0) as f:
+        for b in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            h.update(b)
+    return h.digest()
+
+
+def _walk_files(path):
+    """Yields (relpath, stat) of the regular files under path."""
+    for root, dirs, filenames in os.walk(path):
+        for filename in filenames:
+            filepath = os.path.join(root, filename)
+            st = os.lstat(filepath)
+            if stat.S_ISREG(st.st_mode):
+                yield os.path.relpath(filepath, path), st
+
+
+class _Reference:
+    def __init__(self, path):
+        self.path = path
+        self.by_path = {}
+        self.by_size = {}
+        for relpath, st in _walk_files(path):
+            self.by_path[relpath] = st
+            self.by_size.setdefault(st.st_size, []).append(relpath)
+        self.hashes = {}
+        self.by_hash = {}
+        self.hashed_sizes = set()
+
+    def _hash(self, relpath):
+        if relpath not in self.hashes:
+            self.hashes[relpath] = file_hash(os.path.join(self.path, relpath))
+        return self.hashes[relpath]
+
+    def find(self, relpath, st, filepath):
+        """Returns the reference file identical to the file at filepath,
+        whose stat is st, or None."""
+        digest = None
+        same_path = self.by_path.get(relpath)
+        if same_path is not None and same_path.st_size == st.st_size:
+            # like rsync, trust the size and modification time
+            if same_path.st_mtime_ns == st.st_mtime_ns:
+                return relpath
+            digest = file_hash(filepath)
+            if self._hash(relpath) == digest:
+                return relpath
+        if digest is None:
+            digest = file_hash(filepath)
+        if st.st_size not in self.hashed_sizes:
+            self.hashed_sizes.add(st.st_size)
+            for candidate in self.by_size.get(st.st_size, ()):
+                self.by_hash.setdefault(self._hash(candidate), candidate)
+        return self.by_hash.get(digest)
+
+
+def link_identical(static_path, reference_path):
+    """Replace the files in static_path that have an identical file in
+    reference_path by hardlinks to it. Returns (files linked, bytes saved)."""
+    reference = _Reference(reference_path)
+    linked = 0
+    saved = 0
+    for relpath, st in _walk_files(static_path):
+        if st.st_size not in reference.by_size:
+            continue
+        same_path = reference.by_path.get(relpath)
+        if same_path is not None and (same_path.st_dev, same_path.st_ino) == (st.st_dev, st.st_ino):
+            # linked already, e.g. carried over from the reference
+            continue
+        filepath = os.path.join(static_path, relpath)
+        match = reference.find(relpath, st, filepath)
+        if match is None:
+            continue
+        source = os.path.join(reference_path, match)
+        if os.path.samefile(source, filepath):
+            continue
+        try:
+            output.link(source, filepath, copy=False)
+        except OSError as e:
+            # another filesystem, or too many links to the file already
+            print("Can't link " + filepath + " to " + source + ": " + str(e))
+            continue
+        linked += 1
+        saved += st.st_size
+    return linked, saved
+
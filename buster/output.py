@@ -0,0 +1,97 @@
+"""Writing the files of an export.
+
+A file is written into a temporary file next to it which then replaces it,
+so nobody ever sees a partly written file and a file hardlinked to another
+export is never changed in place. A file that already has the new content is
+left alone. Nothing is fsynced file by file: sync() flushes the whole
+filesystem once the export is complete, before it is published.
+"""
+
+import filecmp
+import locale
+import os
+import shutil
+
+TEMP_SUFFIX = '.buster-tmp'
+
+
+def _encode(data):
+    if isinstance(data, str):
+        # the encoding open() uses for text files
+        return data.encode(locale.getpreferredencoding(False))
+    return data
+
+
+def _has_content(filepath, data):
+    try:
+        if os.stat(filepath).st_size != len(data):
+            return False
+    except FileNotFoundError:
+        return False
+    with open(filepath, 'rb') as f:
+        return f.read() == data
+
+
+def _remove_temp(temppath):
+    # left behind when writing it failed, e.g. the disk is full
+    if os.path.lexists(temppath):
+        os.remove(temppath)
+
+
+def write(filepath, data, previous=None):
+    """Replace filepath with data, bytes or text, unless that's what it
+    contains. previous is its current content, if the caller read it
+    already. Returns whether the file was written."""
+    if previous is not None and data == previous:
+        return False
+    data = _encode(data)
+    if previous is None and _has_content(filepath, data):
+        return False
+    temppath = filepath + TEMP_SUFFIX
+    try:
+        with open(temppath, 'wb') as f:
+            f.write(data)
+        os.replace(temppath, filepath)
+    finally:
+        _remove_temp(temppath)
+    return True
+
+
+def replace(temppath, filepath):
+    """Move the file at temppath over filepath, unless they're the same.
+    Returns whether filepath was replaced."""
+    if os.path.isfile(filepath) and filecmp.cmp(temppath, filepath, shallow=False):
+        os.remove(temppath)
+        return False
+    os.replace(temppath, filepath)
+    return True
+
+
+def link(source, filepath, copy=True):
+    """Replace filepath with a hardlink to source. If that can't be done
+    (source is on another filesystem, or has too many links already), source
+    is copied instead, or with copy=False, the OSError is raised."""
+    temppath = filepath + TEMP_SUFFIX
+    try:
+        try:
+            os.link(source, temppath)
+        except OSError:
+            if not copy:
+                raise
+            shutil.copy2(source, temppath)
+        os.replace(temppath, filepath)
+    finally:
+        _remove_temp(temppath)
+
+
+def sync(path):
+    """Flush everything written to the filesystem holding path to disk."""
+    import ctypes
+    libc = ctypes.CDLL(None, use_errno=True)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        # only Linux has syncfs(); elsewhere sync every filesystem
+        if getattr(libc, 'syncfs', None) is None or libc.syncfs(fd) != 0:
+            os.sync()
+    finally:
+        os.close(fd)
@@ -0,0 +1,57 @@
+"""Spread per-file work over a pool of forked processes.
+
+The pool is forked so that tasks can be closures over generate's state.
+Whatever a task prints is captured in the worker and replayed by the parent
+in the order of the inputs, so the output is the same as a serial run no
+matter how the work was scheduled.
+"""
+
+import contextlib
+import io
+import multiprocessing
+import sys
+import traceback
+
+_task = None
+_initializer = None
+
+
+class WorkerError(Exception):
+    pass
+
+
+def _init():
+    if _initializer is not None:
+        _initializer()
+
+
+def _run(item):
+    out = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(out):
+            result = _task(*item)
+    except Exception:
+        return out.getvalue(), None, traceback.format_exc()
+    return out.getvalue(), result, None
+
+
+def context():
+    return multiprocessing.get_context('fork')
+
+
+def starmap(task, items, jobs, initializer=None):
+    """Yield task(*item) for every item, computed in jobs worker processes.
+    initializer is called in each worker before it starts. If a task raises,
+    WorkerError is raised with its traceback once all earlier items have
+    been yielded."""
+    global _task, _initializer
+    items = list(items)
+    _task = task
+    _initializer = initializer
+    chunksize = max(1, min(16, len(items) // (jobs * 4)))
+    with context().Pool(jobs, initializer=_init) as pool:
+        for item, (out, result, error) in zip(items, pool.imap(_run, items, chunksize)):
+            sys.stdout.write(out)
+            if error is not None:
+                raise WorkerError('Failed on ' + repr(item[0]) + ':\n' + error)
+            yield result
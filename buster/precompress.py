@@ -0,0 +1,128 @@
+"""Precompressed copies of the exported text files.
+
+Web servers can send file.gz or file.br instead of compressing file for
+every request (nginx's gzip_static and brotli_static). These are written for
+every HTML, XML, CSS and JS file big enough and compressible enough to be
+worth it. Brotli is used when the brotli module is installed.
+
+The manifest records the sha256 of every source file and which siblings were
+written for it, so a file that didn't change since the previous export keeps
+the siblings carried over with it, or gets hardlinks to the ones in the
+--link-dest export.
+"""
+
+import gzip
+import hashlib
+import io
+import os
+import output
+import parallel
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+EXTENSIONS = ('.html', '.xml', '.css', '.js', '.json', '.svg', '.txt')
+
+# files smaller than this fit in a packet or two anyway
+MIN_SIZE = 1024
+# siblings that don't get below this fraction of the source aren't written
+MAX_RATIO = 0.9
+
+
+def encodings():
+    if brotli is None:
+        return ('gz',)
+    return ('gz', 'br')
+
+
+def _compress(data, encoding):
+    if encoding == 'gz':
+        # no timestamp, so the same source always gives the same file
+        # (gzip.compress() only takes mtime since Python 3.8)
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=0) as f:
+            f.write(data)
+        return buf.getvalue()
+    return brotli.compress(data, quality=11)
+
+
+def _reusable(entry, digest, dirpath, relpath):
+    """Whether the siblings recorded in a manifest entry are there and
+    were made from a source with the digest."""
+    if entry is None or entry['sha256'] != digest or any(e not in entry for e in encodings()):
+        return False
+    return all(os.path.isfile(os.path.join(dirpath, relpath + '.' + e)) for e in encodings() if entry[e])
+
+
+def compress_file(static_path, relpath, previous, reference_path, reference):
+    """Write the compressed siblings of relpath and return its manifest
+    entry, or None if it's too small. previous is the 'compressed' part of
+    the manifest of the export static_path was copied from, reference the
+    one of the export in reference_path."""
+    filepath = os.path.join(static_path, relpath)
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    if len(data) < MIN_SIZE:
+        return None
+    digest = hashlib.sha256(data).hexdigest()
+    if _reusable(previous.get(relpath), digest, static_path, relpath):
+        return previous[relpath]
+    if reference_path is not None and _reusable(reference.get(relpath), digest, reference_path, relpath):
+        entry = reference[relpath]
+        for encoding in encodings():
+            if entry[encoding]:
+                output.link(os.path.join(reference_path, relpath + '.' + encoding), filepath + '.' + encoding)
+        return entry
+    print("Compress " + filepath)
+    entry = {'sha256': digest}
+    for encoding in encodings():
+        compressed = _compress(data, encoding)
+        entry[encoding] = len(compressed) <= len(data) * MAX_RATIO
+        if entry[encoding]:
+            output.write(filepath + '.' + encoding, compressed)
+    return entry
+
+
+def compress_all(static_path, jobs, previous, reference_path=None, reference=None):
+    """compress_file() every compressible file of the export, in jobs
+    processes. Returns the 'compressed' part of the new manifest."""
+    relpaths = []
+    for root, dirs, filenames in os.walk(static_path):
+        for filename in sorted(filenames):
+            if filename.endswith(EXTENSIONS):
+                relpaths.append(os.path.relpath(os.path.join(root, filename), static_path))
+    reference = reference or {}
+
+    def task(relpath):
+        return compress_file(static_path, relpath, previous, reference_path, reference)
+
+    items = [(relpath,) for relpath in relpaths]
+    if jobs > 1 and len(items) > 1:
+        entries = parallel.starmap(task, items, jobs)
+    else:
+        entries = (task(*item) for item in items)
+    compressed = {}
+    for relpath, entry in zip(relpaths, entries):
+        if entry is not None:
+            compressed[relpath] = entry
+    return compressed
+
+
+def remove_stale(static_path, previous, compressed):
+    """Delete the siblings carried over from the previous export that
+    weren't written again, because their source is gone or changed."""
+    for relpath, entry in previous.items():
+        for encoding in ('gz', 'br'):
+            if entry.get(encoding) and not compressed.get(relpath, {}).get(encoding):
+                filepath = os.path.join(static_path, relpath + '.' + encoding)
+                if os.path.isfile(filepath):
+                    print("Remove " + filepath)
+                    os.remove(filepath)
+                    # the directory of a page that is gone was left for its
+                    # siblings
+                    try:
+                        os.removedirs(os.path.dirname(filepath))
+                    except OSError:
+                        pass
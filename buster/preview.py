@@ -0,0 +1,286 @@
+"""HTTP server for previewing an export.
+
+Connections are handled by a bounded pool of threads, and kept alive until
+they have been idle for a few seconds, so idle clients don't hold on to the
+threads other clients need. Files are kept
+in an LRU cache bounded in bytes and checked with a stat() on every request,
+so an export updated in place is picked up. If the served path is a symlink
+(such as autobuster's current/), a new target gets a new cache, and requests
+in flight finish with the old one.
+
+Responses have an ETag and Last-Modified and honor If-None-Match,
+If-Modified-Since and single byte Range requests. The .br or .gz sibling
+written by --precompress is sent instead of the file when the client accepts
+it.
+"""
+
+import email.utils
+import io
+import os
+import posixpath
+import socket
+import stat
+import threading
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+# (Accept-Encoding token, sibling suffix), in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# seconds a kept-alive connection may stay idle before it is closed
+IDLE_TIMEOUT = 5
+
+
+class _Entry:
+    def __init__(self, path, st, data):
+        self.path = path
+        self.key = (st.st_ino, st.st_size, st.st_mtime_ns)
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.etag = '"%x-%x-%x"' % self.key
+        # None if the file is too big to be cached
+        self.data = data
+
+
+class FileCache:
+    """LRU cache of file contents, bounded by their total size."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 8
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        """Returns the _Entry of the file at path. Raises OSError if there is
+        no such file."""
+        st = os.stat(path)
+        if not stat.S_ISREG(st.st_mode):
+            raise IsADirectoryError(path)
+        key = (st.st_ino, st.st_size, st.st_mtime_ns)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry.key == key:
+                self.entries.move_to_end(path)
+                return entry
+        if st.st_size > self.max_entry_bytes:
+            return _Entry(path, st, None)
+        with open(path, 'rb') as f:
+            data = f.read()
+        entry = _Entry(path, st, data)
+        if len(data) != st.st_size:
+            # changed while we read it; serve it but don't keep it
+            return entry
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.size -= old.size
+            self.entries[path] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size
+        return entry
+
+
+def _accepted_encodings(header):
+    accepted = set()
+    for token in (header or '').split(','):
+        name, _, params = token.partition(';')
+        q = params.strip()
+        if q.startswith('q=') and q[2:].strip() in ('0', '0.0', '0.00', '0.000'):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def _parse_range(header, size):
+    """Returns (start, end) with end exclusive for a single byte range, None
+    if the header should be ignored, or False if it can't be satisfied."""
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, sep, last = header[len('bytes='):].strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if first == '':
+            length = int(last)
+            if length == 0:
+                return False
+            return max(0, size - length), size
+        start = int(first)
+        end = int(last) + 1 if last != '' else size
+    except ValueError:
+        return None
+    if start >= size or end <= start:
+        return False
+    return start, min(end, size)
+
+
+class PreviewHandler(SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    timeout = IDLE_TIMEOUT
+
+    def send_head(self):
+        root, cache = self.server.snapshot()
+        self.directory = root
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            parts = urllib.parse.urlsplit(self.path)
+            if not parts.path.endswith('/'):
+                # redirect to the directory with a slash, with a length so
+                # the connection can be kept alive (Python 3.6 sends none)
+                self.send_response(HTTPStatus.MOVED_PERMANENTLY)
+                self.send_header('Location', urllib.parse.urlunsplit(parts._replace(path=parts.path + '/')))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return None
+            index = os.path.join(path, 'index.html')
+            if not os.path.isfile(index):
+                # list it
+                return super().send_head()
+            path = index
+        try:
+            entry = cache.get(path)
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+
+        byte_range = _parse_range(self.headers.get('Range'), entry.size)
+        if byte_range is not None and self.headers.get('If-Range', entry.etag) != entry.etag:
+            byte_range = None
+
+        body = entry
+        content_encoding = None
+        if byte_range is None:
+            accepted = _accepted_encodings(self.headers.get('Accept-Encoding'))
+            for encoding, suffix in ENCODINGS:
+                if encoding in accepted:
+                    try:
+                        body = cache.get(path + suffix)
+                    except OSError:
+                        continue
+                    content_encoding = encoding
+                    break
+
+        if self._not_modified(body):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self._send_validators(body)
+            self.end_headers()
+            return None
+
+        if byte_range is False:
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header('Content-Range', 'bytes */%d' % entry.size)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+
+        start, end = byte_range or (0, body.size)
+        if byte_range is not None:
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end - 1, body.size))
+        else:
+            self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', self.guess_type(path))
+        if content_encoding is not None:
+            self.send_header('Content-Encoding', content_encoding)
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Vary', 'Accept-Encoding')
+        self._send_validators(body)
+        self.end_headers()
+
+        if body.data is not None:
+            return io.BytesIO(body.data[start:end])
+        f = open(body.path, 'rb')
+        if byte_range is None:
+            return f
+        with f:
+            f.seek(start)
+            return io.BytesIO(f.read(end - start))
+
+    def translate_path(self, path):
+        # SimpleHTTPRequestHandler only serves a directory other than the
+        # working directory since Python 3.7
+        path = path.split('?', 1)[0].split('#', 1)[0]
+        trailing_slash = path.rstrip().endswith('/')
+        path = posixpath.normpath(urllib.parse.unquote(path))
+        result = self.directory
+        for word in filter(None, path.split('/')):
+            if os.path.dirname(word) or word in (os.curdir, os.pardir):
+                continue
+            result = os.path.join(result, word)
+        if trailing_slash:
+            result += '/'
+        return result
+
+    def _send_validators(self, entry):
+        self.send_header('ETag', entry.etag)
+        self.send_header('Last-Modified', self.date_time_string(entry.mtime))
+
+    def _not_modified(self, entry):
+        if 'If-None-Match' in self.headers:
+            tags = [tag.strip() for tag in self.headers['If-None-Match'].split(',')]
+            return '*' in tags or entry.etag in tags
+        if 'If-Modified-Since' in self.headers:
+            try:
+                since = email.utils.parsedate_to_datetime(self.headers['If-Modified-Since'])
+            except (TypeError, IndexError, OverflowError, ValueError):
+                return False
+            return since is not None and int(entry.mtime) <= since.timestamp()
+        return False
+
+
+class PreviewServer(HTTPServer):
+    def __init__(self, server_address, static_path, cache_bytes, threads):
+        super().__init__(server_address, PreviewHandler)
+        self.static_path = static_path
+        self.cache_bytes = cache_bytes
+        self.root = None
+        self.cache = None
+        self.lock = threading.Lock()
+        # connections beyond threads wait in the pool's queue
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.connections = set()
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections.add(request)
+        self.executor.submit(self._process_request_thread, request, client_address)
+
+    def _process_request_thread(self, request, client_address):
+        # as socketserver.ThreadingMixIn does in a thread per connection
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self.lock:
+                self.connections.discard(request)
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        # wake up the threads waiting for a request on their connection, so
+        # that exiting doesn't wait for them
+        with self.lock:
+            for request in self.connections:
+                try:
+                    request.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        self.executor.shutdown(wait=False)
+
+    def snapshot(self):
+        """Returns the directory to serve and its cache."""
+        root = os.path.realpath(self.static_path)
+        with self.lock:
+            if root != self.root:
+                self.root = root
+                self.cache = FileCache(self.cache_bytes)
+            return self.root, self.cache
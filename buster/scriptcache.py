@@ -0,0 +1,72 @@
+"""Persistent store of the integrity-pinned external scripts.
+
+Scripts are stored under their integrity value once they have been
+downloaded and verified, so that later exports (usually into fresh
+directories) get a hardlink to the stored file instead of downloading and
+hashing it again. Since a file is only stored after it matched its
+integrity, a stored file never needs to be checked again.
+"""
+
+import os
+import tempfile
+import subresource_integrity
+import output
+
+
+def calculate_sri(filename, hash):
+    with open(filename, 'rb') as f:
+        data = f.read()
+    return str(list(subresource_integrity.generate(data, [hash]))[0])
+
+
+def verify(filename, integrity):
+    """Raise if the file doesn't match the integrity value, deleting it."""
+    integrity_hash = integrity.split('-', maxsplit=1)[0]
+    found_integrity = calculate_sri(filename, integrity_hash)
+    if integrity != found_integrity:
+        os.unlink(filename)
+        print('Expected integrity', repr(integrity))
+        print('Found integrity', repr(found_integrity))
+        raise Exception('Downloaded file had wrong integrity (' + filename + ')')
+
+
+def integrity_filename(integrity):
+    """The integrity value as it can appear in a filename."""
+    # base64 may contain slashes, which can't be in a filename
+    return integrity.replace('/', '_')
+
+
+class ScriptCache:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _entry(self, integrity):
+        return os.path.join(self.path, integrity_filename(integrity))
+
+    def fetch(self, integrity, download):
+        """Returns the path of the stored file with the integrity value,
+        calling download(path) to get it if it isn't stored yet."""
+        entry = self._entry(integrity)
+        if os.path.isfile(entry):
+            return entry
+        # several exports may share the store, so a file only shows up
+        # under its name once it's complete and verified
+        fd, temppath = tempfile.mkstemp(prefix='.download-', dir=self.path)
+        os.close(fd)
+        try:
+            download(temppath)
+            verify(temppath, integrity)
+            os.chmod(temppath, 0o644)
+            os.replace(temppath, entry)
+        finally:
+            if os.path.exists(temppath):
+                os.remove(temppath)
+        return entry
+
+    def install(self, integrity, download, destination):
+        """Put the file with the integrity value at destination."""
+        entry = self.fetch(integrity, download)
+        if os.path.exists(destination) and os.path.samefile(entry, destination):
+            return
+        output.link(entry, destination)
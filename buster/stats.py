@@ -0,0 +1,103 @@
+"""Timing and counters for the stages of an export.
+
+Each stage records its wall and CPU time, how many times it ran, and the
+files and bytes it handled. Per-file stages run in the --jobs worker
+processes record into the worker's copy, which is sent back to the parent
+with to_dict() and merged; their times are summed over all files, so with
+several jobs they can add up to more than the wall time of the export.
+"""
+
+import heapq
+import json
+import time
+from contextlib import contextmanager
+
+SLOWEST_FILES = 10
+
+
+class Stats:
+    def __init__(self):
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.stages = {}
+        # (seconds, path) of the files that took the longest to fix
+        self.slowest = []
+
+    def _stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = {'wall': 0.0, 'cpu': 0.0, 'calls': 0, 'files': 0, 'bytes': 0}
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name, files=0, bytes=0):
+        """Time the body of the with statement as a run of stage name."""
+        # created now so stages are listed before the ones they contain
+        stage = self._stage(name)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            stage['wall'] += time.perf_counter() - wall
+            stage['cpu'] += time.process_time() - cpu
+            stage['calls'] += 1
+            stage['files'] += files
+            stage['bytes'] += bytes
+
+    @contextmanager
+    def file(self, name, path, bytes=0):
+        """Like stage(), for one file, keeping track of the slowest ones."""
+        wall = time.perf_counter()
+        with self.stage(name, files=1, bytes=bytes):
+            yield
+        self.file_time(path, time.perf_counter() - wall)
+
+    def count(self, name, files=0, bytes=0):
+        stage = self._stage(name)
+        stage['files'] += files
+        stage['bytes'] += bytes
+
+    def file_time(self, path, seconds):
+        item = (seconds, path)
+        if len(self.slowest) < SLOWEST_FILES:
+            heapq.heappush(self.slowest, item)
+        else:
+            heapq.heappushpop(self.slowest, item)
+
+    def reset(self):
+        self.stages = {}
+        self.slowest = []
+
+    def merge(self, other):
+        """Add the stages and files of another Stats' to_dict()."""
+        for name, values in other['stages'].items():
+            stage = self._stage(name)
+            for key, value in values.items():
+                stage[key] += value
+        for item in other['slowest_files']:
+            self.file_time(item['path'], item['seconds'])
+
+    def to_dict(self):
+        return {
+            'wall': time.perf_counter() - self.start_wall,
+            'cpu': time.process_time() - self.start_cpu,
+            'stages': self.stages,
+            'slowest_files': [{'path': path, 'seconds': seconds} for seconds, path in sorted(self.slowest, reverse=True)]
+        }
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+            f.write('\n')
+
+    def print_summary(self):
+        result = self.to_dict()
+        print("{:<24} {:>9} {:>9} {:>7} {:>7} {:>12}".format('Stage', 'wall (s)', 'cpu (s)', 'calls', 'files', 'bytes'))
+        for name, stage in result['stages'].items():
+            print("{:<24} {:>9.2f} {:>9.2f} {:>7} {:>7} {:>12}".format(
+                name, stage['wall'], stage['cpu'], stage['calls'], stage['files'], stage['bytes']))
+        print("{:<24} {:>9.2f} {:>9.2f}".format('total', result['wall'], result['cpu']))
+        if result['slowest_files']:
+            print("Slowest files:")
+            for item in result['slowest_files']:
+                print("  {:7.3f} s  {}".format(item['seconds'], item['path']))
@@ -0,0 +1,106 @@
+"""Rewriting of the urls in links, meta tags, JSON-LD and XML.
+
+All the rules are compiled once per Exporter and every rewritten value is
+memoized, since most of them (navigation, tag and author links, the site url
+itself) repeat on every page and, for a long-lived Exporter, every export.
+"""
+
+import functools
+import re
+
+CACHE_SIZE = 1 << 16
+
+# rss/index.html -> rss/index.xml, index.html -> ''
+index_regex = re.compile(r'(/|^)(rss/)?index\.html$')
+
+
+class UrlRewriter:
+    def __init__(self, source, target):
+        self.source = source
+        self.target = target
+        # Feedly and other readers get links to a feed as .../rss/
+        self.feed_regex = re.compile(re.escape(target) + r'((?:/[^?&]+)?)/rss/([?&]|$)')
+        self.favicon = (target + '/favicon.png', target + '/favicon.ico')
+        self.absolute = functools.lru_cache(CACHE_SIZE)(self._absolute)
+        self.href = functools.lru_cache(CACHE_SIZE)(self._href)
+        self.xml_url = functools.lru_cache(CACHE_SIZE)(self._xml_url)
+
+    def text(self, data):
+        """Replace every occurrence of the source url."""
+        return data.replace(self.source, self.target)
+
+    def _absolute(self, url):
+        """Replace the source url at the start of url."""
+        if url.startswith(self.source):
+            return self.target + url[len(self.source):]
+        return url
+
+    def _index_repl(self, m):
+        return m.group(1) + 'rss/index.xml' if m.group(2) else m.group(1)
+
+    def _feed_repl(self, m):
+        return self.target + m.group(1) + '/rss/index.xml' + m.group(2)
+
+    def _href(self, href, absolute):
+        """The new value of an href in an HTML page; absolute tells whether
+        it has a scheme or starts with //."""
+        if not absolute:
+            if 'index.html' in href:
+                href = index_regex.sub(self._index_repl, href)
+            return href
+        # social sharing links have the url in their query string
+        href = self.text(href)
+        if '/rss/' in href:
+            href = self.feed_regex.sub(self._feed_repl, href)
+        return href
+
+    def _xml_url(self, url):
+        """The new value of a <loc>, <link> or <url> in a sitemap or feed."""
+        url = self._absolute(url)
+        # /favicon.png is a redirect in ghost, so no favicon.png exists.
+        if url == self.favicon[0]:
+            return self.favicon[1]
+        return url
+
+
+class QueryStripper:
+    """Removes the query strings left in the text of a page after the files
+    they were attached to were renamed without them, e.g.
+    screen.css?v=1a2b3c" -> screen.css".
+
+    Filenames are looked up in a set by the text in front of each ?, so the
+    cost doesn't depend on how many files were renamed."""
+
+    suffix_regex = re.compile(r'\?[^"\n]*(?=")')
+
+    def __init__(self, filenames):
+        self.filenames = {filename.lower() for filename in filenames}
+        self.lengths = sorted({len(filename) for filename in self.filenames}, reverse=True)
+
+    def _filename_before(self, data, end):
+        for length in self.lengths:
+            if length <= end and data[end - length:end].lower() in self.filenames:
+                return data[end - length:end]
+        return None
+
+    def sub(self, data, on_remove=None):
+        """Returns data without the query strings. on_remove(filename,
+        query) is called for each one removed."""
+        if not self.filenames:
+            return data
+        parts = []
+        start = 0
+        i = data.find('?')
+        while i != -1:
+            filename = self._filename_before(data, i)
+            m = self.suffix_regex.match(data, i) if filename is not None else None
+            if m is None:
+                i = data.find('?', i + 1)
+                continue
+            if on_remove is not None:
+                on_remove(filename, m.group())
+            parts.append(data[start:i])
+            start = m.end()
+            i = data.find('?', start)
+        parts.append(data[start:])
+        return ''.join(parts)
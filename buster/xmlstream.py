@@ -0,0 +1,153 @@
+"""Streaming rewrite of XML files such as sitemaps and RSS feeds.
+
+The file is parsed with iterparse and every element is handed to a fix
+function as soon as it ends. The repeated elements that make up the bulk of
+these files (sitemap <url>s, RSS <item>s, Atom <entry>s) are serialized and
+dropped from the tree one at a time, so memory use is bounded by the size of
+one of them instead of the whole document.
+
+The output is byte for byte what etree.tostring(root, pretty_print=True,
+xml_declaration=True, encoding='utf-8') gives for the fixed tree: records are
+pretty-printed by libxml2 inside a bare copy of their ancestors, and the rest
+of the document is serialized around a placeholder comment.
+"""
+
+import os
+from lxml import etree
+import output
+
+# (container, record) local names of the elements that are streamed
+RECORDS = {
+    ('urlset', 'url'),
+    ('sitemapindex', 'sitemap'),
+    ('channel', 'item'),
+    ('feed', 'entry'),
+}
+
+MARKER = 'buster-xmlstream-records'
+
+
+class NotStreamable(Exception):
+    """The document has text between records, which turns off libxml2's
+    pretty printing for their container, so it can't be written piecewise."""
+
+
+def _localname(el):
+    return etree.QName(el).localname
+
+
+def _formattable(el):
+    return el.text is None and all(child.tail is None for child in el)
+
+
+def _serialize(root):
+    return etree.tostring(root, encoding='utf-8', pretty_print=True, xml_declaration=True)
+
+
+class _RecordWriter:
+    """Serializes records the way libxml2 would inside their ancestors."""
+
+    def __init__(self, parent):
+        ancestors = [parent] + list(parent.iterancestors())
+        ancestors.reverse()
+        self.wrapper = None
+        outer_nsmap = {}
+        for ancestor in ancestors:
+            nsmap = {k: v for k, v in ancestor.nsmap.items() if outer_nsmap.get(k) != v}
+            if self.wrapper is None:
+                self.wrapper = self.container = etree.Element(ancestor.tag, nsmap=nsmap)
+            else:
+                self.container = etree.SubElement(self.container, ancestor.tag, nsmap=nsmap)
+            outer_nsmap = ancestor.nsmap
+        marker = etree.Comment(MARKER)
+        self.container.append(marker)
+        text = etree.tostring(self.wrapper, encoding='utf-8', pretty_print=True)
+        marker_text = etree.tostring(marker, encoding='utf-8')
+        start = text.index(marker_text)
+        self.head_length = start
+        self.tail_length = len(text) - start - len(marker_text)
+        self.container.remove(marker)
+
+    def write(self, record):
+        self.container.append(record)
+        text = etree.tostring(self.wrapper, encoding='utf-8', pretty_print=True)
+        self.container.remove(record)
+        return text[self.head_length:len(text) - self.tail_length]
+
+
+def rewrite(source_path, destination_path, fix_element=None, fix_text=None, stream=True):
+    """Rewrite the XML file at source_path into destination_path.
+
+    fix_element(el) is called once for every element, after its children.
+    fix_text(str) is applied to the serialized output, one record (or the
+    text around the records) at a time. Raises NotStreamable if stream is
+    set and the document can't be streamed; call again with stream=False to
+    rewrite it in memory."""
+    parser_events = etree.iterparse(source_path, events=('end',), encoding='utf-8',
+                                    strip_cdata=False, resolve_entities=True)
+
+    def emit(out, data):
+        if fix_text is not None:
+            data = fix_text(data.decode('utf-8')).encode('utf-8')
+        out.write(data)
+
+    with open(destination_path, 'wb') as out:
+        root = None
+        marker = None
+        writer = None
+        indent = b''
+        # ancestors fixed early because they were written before they ended
+        fixed_early = set()
+        for event, el in parser_events:
+            root = el if el.getparent() is None else root
+            if el in fixed_early:
+                continue
+            if fix_element is not None:
+                fix_element(el)
+            parent = el.getparent()
+            if not stream or parent is None or (_localname(parent), _localname(el)) not in RECORDS:
+                continue
+            if marker is None:
+                if not _formattable(parent) or el.tail is not None:
+                    raise NotStreamable()
+                marker = etree.Comment(MARKER)
+                el.addprevious(marker)
+                parent.remove(el)
+                ancestors = list(marker.iterancestors())
+                if fix_element is not None:
+                    for ancestor in ancestors:
+                        fix_element(ancestor)
+                fixed_early.update(ancestors)
+                text = _serialize(ancestors[-1])
+                start = text.index(etree.tostring(marker, encoding='utf-8'))
+                indent = text[text.rindex(b'\n', 0, start):start]
+                emit(out, text[:start])
+                writer = _RecordWriter(parent)
+                emit(out, writer.write(el))
+            elif marker.getnext() is el:
+                parent.remove(el)
+                emit(out, indent + writer.write(el))
+            else:
+                raise NotStreamable()
+        if marker is None:
+            emit(out, _serialize(root))
+            return
+        if not _formattable(marker.getparent()):
+            raise NotStreamable()
+        text = _serialize(root)
+        marker_text = etree.tostring(marker, encoding='utf-8')
+        emit(out, text[text.index(marker_text) + len(marker_text):])
+
+
+def rewrite_in_place(filepath, fix_element=None, fix_text=None):
+    """rewrite() filepath into a temporary file next to it and replace it."""
+    temppath = filepath + output.TEMP_SUFFIX
+    try:
+        try:
+            rewrite(filepath, temppath, fix_element, fix_text)
+        except NotStreamable:
+            rewrite(filepath, temppath, fix_element, fix_text, stream=False)
+        output.replace(temppath, filepath)
+    finally:
+        if os.path.exists(temppath):
+            os.remove(temppath)
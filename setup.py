@@ -15,5 +15,5 @@ setup(name="buster",
       license="MIT",
       packages=["buster"],
       entry_points={"console_scripts": ["buster = buster.buster:main"]},
-      install_requires=['GitPython==0.3.2.RC1', 'async==0.6.1', 'gitdb==0.5.4', 'smmap==0.8.2', 'lxml>=3.4.1', 'beautifulsoup4>=4.3.2', 'html5lib', 'argparse']
+      install_requires=['GitPython==0.3.2.RC1', 'async==0.6.1', 'gitdb==0.5.4', 'smmap==0.8.2', 'lxml>=3.4.1', 'argparse']
     )